@@ -1,29 +1,113 @@
 from __future__ import annotations
 
+import asyncio
+import random
+import re
 import ssl
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Iterator
+from contextlib import AsyncExitStack
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from contextvars import ContextVar
 from types import TracebackType
 from typing import Any
 from typing import Type
+from typing import TypeVar
+from urllib.parse import urlsplit
+from uuid import uuid4
 
+import asyncpg
+import orjson
+from common import logger
+from common import metrics
+from common.rate_limit import ConcurrencyLimiter
+from common.rate_limit import TokenBucketLimiter
 from databases import Database as _Database
 from databases.core import Connection
 from databases.core import Transaction
 
+T = TypeVar("T")
+
 
 def _create_pool(
     dsn: str,
     min_pool_size: int,
     max_pool_size: int,
     ssl: bool | ssl.SSLContext,
+    statement_timeout: float,
 ) -> _Database:
+    server_settings = {}
+    if statement_timeout:
+        server_settings["statement_timeout"] = str(int(statement_timeout * 1000))
+
     return _Database(
         url=dsn,
         min_size=min_pool_size,
         max_size=max_pool_size,
         ssl=ssl,
+        server_settings=server_settings,
     )
 
 
+# monotonic time by which queries of the current request (or job) must be done
+_deadline: ContextVar[float | None] = ContextVar("database_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """Cap the timeout of every query made in the block to `seconds` from now.
+
+    None lifts the cap, for work that must finish even once the request that
+    started it ran out of time.
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class QueryTimeoutError(TimeoutError):
+    """A query ran out of time, client-side or against `statement_timeout`."""
+
+    def __init__(self, name: str | None, timeout: float) -> None:
+        super().__init__(f"query {name or '(unnamed)'} timed out after {timeout:.3g}s")
+        self.name = name
+        self.timeout = timeout
+
+
+# errors raised by queries, whatever the cause. OSError is left out: it
+# isn't only raised by the database
+DATABASE_ERRORS = (
+    QueryTimeoutError,
+    asyncpg.PostgresError,
+    asyncpg.InterfaceError,
+)
+
+
+# EXPLAIN without ANALYZE only plans, it should never take long
+_EXPLAIN_TIMEOUT = 2.0
+
+# quoted literals in a plan: strings, arrays, timestamps... of bound values
+_PLAN_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def _param_shape(values: dict[str, Any] | None) -> dict[str, str]:
+    """Type of each parameter (and length of lists), never their values."""
+    return {
+        key: (
+            f"{type(value).__name__}[{len(value)}]"
+            if isinstance(value, (list, tuple))
+            else type(value).__name__
+        )
+        for key, value in (values or {}).items()
+    }
+
+
 # TODO: refactor this to support dialect/driver separation,
 #       and to leverage the robust urllib.parse.urlunparse.
 def dsn(
@@ -37,30 +121,154 @@ def dsn(
     return f"{scheme}://{user}:{password}@{host}:{port}/{database}"
 
 
+# errors meaning a server (or the way to it) is gone, rather than the query
+# being wrong. TimeoutError is an OSError too, but it isn't one of them.
+_CONNECTION_ERRORS = (
+    OSError,
+    asyncpg.ConnectionDoesNotExistError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.AdminShutdownError,
+)
+
+
+class _Pool:
+    """A connection pool, and what the read balancer knows about it."""
+
+    __slots__ = ("name", "pool", "outstanding", "healthy", "failures")
+
+    def __init__(self, name: str, pool: _Database) -> None:
+        self.name = name
+        self.pool = pool
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+
+
+# :name parameters, found the way sqlalchemy's text() finds them
+_BIND_PARAM = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+
+def _positional(
+    query: str,
+    values: list[dict[str, Any]],
+) -> tuple[str, list[tuple[Any, ...]]]:
+    """`query` with $n parameters and `values` as tuples, as asyncpg takes them."""
+    names: list[str] = []
+
+    def number(match: re.Match[str]) -> str:
+        if match[1] not in names:
+            names.append(match[1])
+        return f"${names.index(match[1]) + 1}"
+
+    query = _BIND_PARAM.sub(number, query)
+    return query, [tuple(row[name] for name in names) for row in values]
+
+
+class _UnitOfWork:
+    """The write connection pinned by a `Database.unit_of_work` block."""
+
+    __slots__ = ("connection", "transaction", "queued", "finishing")
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.transaction: Transaction | None = None
+        # (name, query, values of each run), consecutive runs of a query batched
+        self.queued: list[tuple[str | None, str, list[dict[str, Any]]]] = []
+        self.finishing = False
+
+    def queue(self, name: str | None, query: str, values: dict[str, Any]) -> None:
+        if self.queued and self.queued[-1][1] == query:
+            self.queued[-1][2].append(values)
+        else:
+            self.queued.append((name, query, [values]))
+
+
+# the unit of work the current task is in
+_unit: ContextVar[_UnitOfWork | None] = ContextVar("database_unit", default=None)
+
+
 class Database:
-    """Wrapper around read & write database pools to simplify usage."""
+    """Wrapper around read & write database pools to simplify usage.
+
+    Reads go to the healthy read replica with the fewest queries in flight.
+    A replica is ejected after `eject_after` connection errors in a row and
+    probed every `probe_interval` seconds until it answers again; while no
+    replica is healthy, reads go to the primary (the write pool). A read that
+    fails because its replica went away is retried once elsewhere. Reads
+    that write, such as INSERT ... RETURNING, must pass `primary=True`.
+
+    Every connection runs with `statement_timeout` seconds at most per
+    statement, enforced by the server. On top of that, each call waits for
+    at most its `timeout`, else the timeout configured for its `name` in
+    `query_timeouts`, else `default_timeout`, and never past the current
+    `deadline`. A query that runs out of time is cancelled on the server and
+    its connection goes back to the pool; the caller gets a
+    `QueryTimeoutError`. Timeouts of 0 mean no limit.
+
+    Statements taking `slow_query_threshold` seconds or more are logged with
+    their name and parameter shape. A sample of them (`explain_sample_rate`)
+    is explained on another connection first, at most once per
+    `explain_interval` seconds per name and one at a time, and logged with
+    their plan.
+
+    Flows of several statements go in a `unit_of_work`, see there.
+    """
 
     def __init__(
         self,
-        read_dsn: str,
+        read_dsns: list[str],
         read_db_ssl: bool | ssl.SSLContext,
         write_dsn: str,
         write_db_ssl: bool | ssl.SSLContext,
         min_pool_size: int,
         max_pool_size: int,
+        statement_timeout: float = 0,
+        default_timeout: float = 0,
+        query_timeouts: dict[str, float] | None = None,
+        slow_query_threshold: float = 0,
+        explain_sample_rate: float = 0,
+        explain_interval: float = 300,
+        eject_after: int = 3,
+        probe_interval: float = 5,
     ) -> None:
-        self.read_pool = _create_pool(
-            read_dsn,
-            min_pool_size,
-            max_pool_size,
-            read_db_ssl,
-        )
+        self.read_pools = [
+            _Pool(
+                urlsplit(read_dsn).netloc.rpartition("@")[2],
+                _create_pool(
+                    read_dsn,
+                    min_pool_size,
+                    max_pool_size,
+                    read_db_ssl,
+                    statement_timeout,
+                ),
+            )
+            for read_dsn in read_dsns
+        ]
         self.write_pool = _create_pool(
             write_dsn,
             min_pool_size,
             max_pool_size,
             write_db_ssl,
+            statement_timeout,
         )
+        self._primary = _Pool("primary", self.write_pool)
+        self.eject_after = eject_after
+        self.probe_interval = probe_interval
+        self._prober: asyncio.Task[None] | None = None
+        self.statement_timeout = statement_timeout
+        self.default_timeout = default_timeout
+        self.query_timeouts = query_timeouts or {}
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_sample_rate = explain_sample_rate
+        self._explain_limiter = TokenBucketLimiter(
+            "slow_query_explain",
+            capacity=1,
+            period=explain_interval,
+            max_keys=1000,
+        )
+        self._explain_concurrency = ConcurrencyLimiter("slow_query_explain", 1)
+        self._explains: set[asyncio.Task[None]] = set()
 
     async def __aenter__(self) -> "Database":
         await self.connect()
@@ -75,7 +283,7 @@ class Database:
         await self.disconnect()
 
     def connection(self) -> Connection:
-        return self.read_pool.connection()
+        return self._pick_read_pool().pool.connection()
 
     def transaction(
         self,
@@ -88,21 +296,389 @@ class Database:
             **kwargs,
         )
 
+    @asynccontextmanager
+    async def unit_of_work(self, *, name: str | None = None) -> AsyncIterator[None]:
+        """Run the block's statements on one write connection, committed together.
+
+        Every query made in the block, reads included, goes to that
+        connection and sees the block's own writes. `execute` doesn't wait
+        for its statement: it's queued and sent before the next statement
+        that returns rows, or when the block ends. Consecutive runs of the
+        same statement are sent together, in one round trip. Nothing is
+        committed if the block raises.
+
+        The transaction is only opened by the first statement sent, and not
+        at all for a block that comes down to a single batch of writes. A
+        block nested in another one is part of it. `iterate` streams from
+        the read replicas as usual.
+        """
+        if _unit.get() is not None:
+            yield
+            return
+
+        async with AsyncExitStack() as stack:
+            timeout = self._timeout(name, None)
+            try:
+                async with asyncio.timeout(timeout):
+                    connection = await stack.enter_async_context(
+                        self.write_pool.connection(),
+                    )
+            except TimeoutError as exc:
+                self._on_timeout(name)
+                raise QueryTimeoutError(name, max(timeout or 0, 0)) from exc
+
+            unit = _UnitOfWork(connection)
+            token = _unit.set(unit)
+            try:
+                yield
+                unit.finishing = unit.transaction is None and len(unit.queued) <= 1
+                await self._flush(unit)
+            except BaseException:
+                if unit.transaction is not None:
+                    # the pool rolls back what's left open on release anyway
+                    try:
+                        await unit.transaction.rollback()
+                    except Exception:
+                        pass
+                raise
+            else:
+                if unit.transaction is not None:
+                    await unit.transaction.commit()
+            finally:
+                _unit.reset(token)
+
+    async def _flush(self, unit: _UnitOfWork) -> None:
+        queued, unit.queued = unit.queued, []
+        for name, query, values in queued:
+            await self._execute_batch(query, values, name, None)
+
+    async def _execute_batch(
+        self,
+        query: str,
+        values: list[dict[str, Any]],
+        name: str | None,
+        timeout: float | None,
+    ) -> None:
+        query, args = _positional(query, values)
+
+        # a batch has no single plan, it's timed and logged without one
+        async with self._statement(
+            self._primary,
+            name,
+            timeout,
+            query,
+            None,
+            explain=False,
+        ) as connection:
+            # asyncpg pipelines the runs, and applies them all or none
+            await connection.raw_connection.executemany(query, args)
+
+    @asynccontextmanager
+    async def advisory_lock(self, key: int) -> AsyncIterator[bool]:
+        """Try to take a session advisory lock on the write server.
+
+        Yields whether it was taken, so a job can skip its run when another
+        process is already at it. The lock is held (with the connection) for
+        the duration of the block.
+        """
+        async with self.write_pool.connection() as connection:
+            locked = await connection.fetch_val(
+                "SELECT pg_try_advisory_lock(:key)",
+                {"key": key},
+            )
+            try:
+                yield bool(locked)
+            finally:
+                if locked:
+                    await connection.execute(
+                        "SELECT pg_advisory_unlock(:key)",
+                        {"key": key},
+                    )
+
+    def _timeout(self, name: str | None, timeout: float | None) -> float | None:
+        if timeout is None:
+            timeout = self.query_timeouts.get(name or "", self.default_timeout)
+
+        deadline = _deadline.get()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            timeout = min(timeout, remaining) if timeout else remaining
+
+        return timeout or None
+
+    def _pick_read_pool(self, exclude: _Pool | None = None) -> _Pool:
+        candidates = [
+            pool for pool in self.read_pools if pool.healthy and pool is not exclude
+        ]
+        if not candidates:
+            metrics.increment("database.read_fallbacks")
+            return self._primary
+
+        # ties are broken at random, so idle replicas share the load
+        return min(candidates, key=lambda pool: (pool.outstanding, random.random()))
+
+    def _set_healthy(self, target: _Pool, healthy: bool) -> None:
+        target.healthy = healthy
+        target.failures = 0
+        metrics.gauge(f"database.pool.{target.name}.healthy", int(healthy))
+
+    def _on_connection_error(self, target: _Pool, exc: BaseException) -> None:
+        metrics.increment(f"database.pool.{target.name}.connection_errors")
+        if target is self._primary or not target.healthy:
+            return
+
+        target.failures += 1
+        if target.failures >= self.eject_after:
+            logger.warning(
+                "Ejected unhealthy read replica",
+                replica=target.name,
+                reason=repr(exc),
+            )
+            metrics.increment("database.replica_ejections")
+            self._set_healthy(target, False)
+
+    async def _probe_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+
+            for target in self.read_pools:
+                if target.healthy:
+                    continue
+
+                try:
+                    async with asyncio.timeout(self.probe_interval):
+                        if not target.pool.is_connected:
+                            await target.pool.connect()
+                        async with target.pool.connection() as connection:
+                            await connection.fetch_val("SELECT 1")
+                except Exception:
+                    continue
+
+                logger.info("Read replica is healthy again", replica=target.name)
+                self._set_healthy(target, True)
+
+    @asynccontextmanager
+    async def _statement(
+        self,
+        target: _Pool,
+        name: str | None,
+        timeout: float | None,
+        query: str,
+        values: dict[str, Any] | None,
+        explain: bool = True,
+    ) -> AsyncIterator[Connection]:
+        unit = _unit.get()
+        if unit is not None:
+            target = self._primary
+            await self._flush(unit)
+
+        timeout = self._timeout(name, timeout)
+        target.outstanding += 1
+
+        try:
+            if timeout is not None and timeout <= 0:
+                raise TimeoutError
+
+            async with asyncio.timeout(timeout):
+                async with (
+                    unit.connection if unit is not None else target.pool.connection()
+                ) as connection:
+                    if (
+                        unit is not None
+                        and unit.transaction is None
+                        and not unit.finishing
+                    ):
+                        unit.transaction = await connection.transaction().start()
+
+                    started_at = time.perf_counter()
+                    try:
+                        yield connection
+                    finally:
+                        self._on_statement_done(
+                            target,
+                            name,
+                            query,
+                            values,
+                            explain,
+                            time.perf_counter() - started_at,
+                        )
+        except TimeoutError as exc:
+            self._on_timeout(name)
+            raise QueryTimeoutError(name, max(timeout or 0, 0)) from exc
+        except asyncpg.QueryCanceledError as exc:
+            self._on_timeout(name)
+            raise QueryTimeoutError(name, self.statement_timeout) from exc
+        except _CONNECTION_ERRORS as exc:
+            self._on_connection_error(target, exc)
+            raise
+        else:
+            target.failures = 0
+        finally:
+            target.outstanding -= 1
+
+    async def _read(
+        self,
+        name: str | None,
+        timeout: float | None,
+        query: str,
+        values: dict[str, Any] | None,
+        primary: bool,
+        fetch: Callable[[Connection], Awaitable[T]],
+    ) -> T:
+        if primary or _unit.get() is not None:
+            target = self._primary
+        else:
+            target = self._pick_read_pool()
+
+        try:
+            async with self._statement(
+                target,
+                name,
+                timeout,
+                query,
+                values,
+            ) as connection:
+                return await fetch(connection)
+        except _CONNECTION_ERRORS as exc:
+            if target is self._primary or isinstance(exc, TimeoutError):
+                raise
+
+        # a read has no effect to repeat, so it's retried on another pool
+        metrics.increment("database.read_retries")
+        async with self._statement(
+            self._pick_read_pool(exclude=target),
+            name,
+            timeout,
+            query,
+            values,
+        ) as connection:
+            return await fetch(connection)
+
+    def _on_timeout(self, name: str | None) -> None:
+        metrics.increment("database.timeouts")
+        if name is not None:
+            metrics.increment(f"database.timeouts.{name}")
+
+    def _on_statement_done(
+        self,
+        target: _Pool,
+        name: str | None,
+        query: str,
+        values: dict[str, Any] | None,
+        explain: bool,
+        elapsed: float,
+    ) -> None:
+        metrics.observe(f"database.query_time.{name or 'unnamed'}", elapsed)
+        metrics.observe(f"database.pool.{target.name}.query_time", elapsed)
+        if not self.slow_query_threshold or elapsed < self.slow_query_threshold:
+            return
+
+        metrics.increment("database.slow_queries")
+        fields = {
+            "query": name,
+            "duration": round(elapsed, 4),
+            "params": _param_shape(values),
+        }
+        if not explain or not self._should_explain(name):
+            logger.warning("Slow database query", **fields)
+            return
+
+        task = asyncio.create_task(
+            self._log_with_plan(target.pool, query, values, fields),
+        )
+        self._explains.add(task)
+        task.add_done_callback(self._explains.discard)
+
+    def _should_explain(self, name: str | None) -> bool:
+        if random.random() >= self.explain_sample_rate:
+            return False
+
+        if not self._explain_concurrency.try_acquire():
+            return False
+
+        if not self._explain_limiter.allow(name or ""):
+            self._explain_concurrency.release()
+            return False
+
+        return True
+
+    async def _log_with_plan(
+        self,
+        pool: _Database,
+        query: str,
+        values: dict[str, Any] | None,
+        fields: dict[str, Any],
+    ) -> None:
+        try:
+            # not the caller's work, it doesn't count against its deadline
+            with deadline(None):
+                async with asyncio.timeout(_EXPLAIN_TIMEOUT):
+                    async with pool.connection() as connection:
+                        rows = await connection.fetch_all(
+                            f"EXPLAIN (ANALYZE off) {query}",
+                            values,
+                        )
+
+            plan = "\n".join(row._mapping["QUERY PLAN"] for row in rows)
+            # the plan shows the bound values, they stay out of the logs
+            fields["plan"] = _PLAN_LITERAL.sub("'?'", plan)
+            metrics.increment("database.slow_queries.explained")
+        except Exception as exc:
+            fields["plan_error"] = repr(exc)
+        finally:
+            self._explain_concurrency.release()
+
+        logger.warning("Slow database query", **fields)
+
     async def connect(self) -> None:
-        await self.read_pool.connect()
         await self.write_pool.connect()
 
+        for target in self.read_pools:
+            try:
+                await target.pool.connect()
+            except Exception as exc:
+                # reads can do without it, it's probed like an ejected one
+                logger.warning(
+                    "Failed to connect to read replica",
+                    replica=target.name,
+                    reason=repr(exc),
+                )
+                self._set_healthy(target, False)
+            else:
+                self._set_healthy(target, True)
+
+        self._prober = asyncio.create_task(self._probe_forever())
+
     async def disconnect(self) -> None:
-        await self.read_pool.disconnect()
+        if self._prober is not None:
+            self._prober.cancel()
+            self._prober = None
+
+        for task in list(self._explains):
+            task.cancel()
+
+        for target in self.read_pools:
+            if target.pool.is_connected:
+                await target.pool.disconnect()
         await self.write_pool.disconnect()
 
     async def fetch_one(
         self,
         query: str,
         values: dict[str, Any] | None = None,
+        *,
+        name: str | None = None,
+        timeout: float | None = None,
+        primary: bool = False,
     ) -> dict[str, Any] | None:
-        async with self.read_pool.connection() as connection:
-            rec = await connection.fetch_one(query, values)
+        rec = await self._read(
+            name,
+            timeout,
+            query,
+            values,
+            primary,
+            lambda connection: connection.fetch_one(query, values),
+        )
 
         return dict(rec._mapping) if rec is not None else None
 
@@ -110,15 +686,67 @@ class Database:
         self,
         query: str,
         values: dict[str, Any] | None = None,
+        *,
+        name: str | None = None,
+        timeout: float | None = None,
+        primary: bool = False,
     ) -> list[dict[str, Any]]:
-        async with self.read_pool.connection() as connection:
-            recs = await connection.fetch_all(query, values)
+        recs = await self._read(
+            name,
+            timeout,
+            query,
+            values,
+            primary,
+            lambda connection: connection.fetch_all(query, values),
+        )
 
         return [dict(rec._mapping) for rec in recs]
 
-    async def fetch_val(self, query: str, values: dict[str, Any] | None = None) -> Any:
-        async with self.read_pool.connection() as connection:
-            val = await connection.fetch_val(query, values)
+    async def iterate(
+        self,
+        query: str,
+        values: dict[str, Any] | None = None,
+        *,
+        name: str | None = None,
+        primary: bool = False,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Stream rows through a server-side cursor instead of loading them all.
+
+        A stream lasts as long as its consumer wants it to, so only
+        `statement_timeout` applies, to each fetch from the cursor.
+        """
+        target = self._primary if primary else self._pick_read_pool()
+        target.outstanding += 1
+        try:
+            async with target.pool.connection() as connection:
+                async for rec in connection.iterate(query, values):
+                    yield dict(rec._mapping)
+        except _CONNECTION_ERRORS as exc:
+            self._on_connection_error(target, exc)
+            raise
+        except asyncpg.QueryCanceledError as exc:
+            self._on_timeout(name)
+            raise QueryTimeoutError(name, self.statement_timeout) from exc
+        finally:
+            target.outstanding -= 1
+
+    async def fetch_val(
+        self,
+        query: str,
+        values: dict[str, Any] | None = None,
+        *,
+        name: str | None = None,
+        timeout: float | None = None,
+        primary: bool = False,
+    ) -> Any:
+        val = await self._read(
+            name,
+            timeout,
+            query,
+            values,
+            primary,
+            lambda connection: connection.fetch_val(query, values),
+        )
 
         return val
 
@@ -126,14 +754,237 @@ class Database:
         self,
         query: str,
         values: dict[str, Any] | None = None,
+        *,
+        name: str | None = None,
+        timeout: float | None = None,
     ) -> Any:  # TODO: this Any can surely be typed better
-        async with self.write_pool.connection() as connection:
+        """Run a statement, or queue it in the current `unit_of_work` (None)."""
+        unit = _unit.get()
+        if unit is not None:
+            unit.queue(name, query, values or {})
+            return None
+
+        async with self._statement(
+            self._primary,
+            name,
+            timeout,
+            query,
+            values,
+        ) as connection:
             result = await connection.execute(query, values)
 
         return result
 
-    async def execute_many(self, query: str, values: list[Any]) -> None:
-        async with self.write_pool.connection() as connection:
-            await connection.execute_many(query, values)
+    async def execute_many(
+        self,
+        query: str,
+        values: list[dict[str, Any]],
+        *,
+        name: str | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        await self._execute_batch(query, values, name, timeout)
+
+
+# NOTIFY payloads are limited to 8000 bytes, keys are at most ~50 bytes
+_MAX_KEYS_PER_NOTIFICATION = 100
+
+# called with the invalidated keys, or None when everything must go
+Invalidator = Callable[[list[str] | None], Awaitable[None]]
+
+
+class InvalidationBus:
+    """Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+    Writers `publish` the keys they changed under a topic ("users", ...),
+    and every other process runs the invalidators subscribed to that topic.
+    Notifications are sent through the write pool and received on a
+    dedicated connection to the same server, kept alive with a periodic
+    ping and reopened if it's lost.
+
+    Notifications sent while disconnected are lost for good, so after
+    reconnecting every invalidator is called with None to flush everything.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        listen_dsn: str,
+        listen_db_ssl: bool | ssl.SSLContext,
+        channel: str,
+        reconnect_delay: float,
+        keepalive_interval: float,
+    ) -> None:
+        self.database = database
+        self.listen_dsn = listen_dsn
+        self.listen_db_ssl = listen_db_ssl
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.keepalive_interval = keepalive_interval
+
+        # our own notifications come back to us too, they're skipped
+        self.origin = uuid4().hex
+        self._invalidators: dict[str, list[Invalidator]] = {}
+        self._listener: asyncio.Task[None] | None = None
+        self._pending: set[asyncio.Task[None]] = set()
+
+    def subscribe(self, topic: str, invalidator: Invalidator) -> None:
+        self._invalidators.setdefault(topic, []).append(invalidator)
+
+    async def publish(self, topic: str, keys: list[str]) -> None:
+        """Tell other processes the keys changed.
+
+        This runs after the write was committed, a failure is logged rather
+        than raised: the caller's write did happen. In a unit of work, the
+        notification is sent with the unit's writes and only delivered once
+        they're committed.
+        """
+        for i in range(0, len(keys), _MAX_KEYS_PER_NOTIFICATION):
+            payload = orjson.dumps(
+                {
+                    "origin": self.origin,
+                    "topic": topic,
+                    "keys": keys[i : i + _MAX_KEYS_PER_NOTIFICATION],
+                },
+            ).decode()
+
+            try:
+                # the write happened, its request running out of time doesn't
+                # make other processes' caches any less stale
+                with deadline(None):
+                    await self.database.execute(
+                        "SELECT pg_notify(:channel, :payload)",
+                        {"channel": self.channel, "payload": payload},
+                        name="invalidation.publish",
+                    )
+            except Exception as exc:
+                metrics.increment("invalidation.publish_failures")
+                logger.warning(
+                    "Failed to publish cache invalidation",
+                    topic=topic,
+                    reason=repr(exc),
+                )
+                return
+
+            metrics.increment("invalidation.published")
+
+    async def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen_forever())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+        for task in list(self._pending):
+            task.cancel()
+
+    async def _listen_forever(self) -> None:
+        connected_before = False
+
+        while True:
+            try:
+                connection = await asyncpg.connect(
+                    self.listen_dsn,
+                    ssl=self.listen_db_ssl,
+                )
+            except (OSError, asyncpg.PostgresError) as exc:
+                logger.warning(
+                    "Failed to connect the cache invalidation listener",
+                    reason=repr(exc),
+                )
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            except Exception as exc:
+                # anything else would end the task, and invalidations with it
+                logger.error(
+                    "Failed to connect the cache invalidation listener",
+                    exc_info=exc,
+                )
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            try:
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._on_notification)
+                metrics.gauge("invalidation.connected", 1)
+
+                if connected_before:
+                    logger.warning(
+                        "Cache invalidation listener reconnected, flushing caches",
+                    )
+                    metrics.increment("invalidation.full_flushes")
+                    self._invalidate_all()
+                connected_before = True
+
+                await self._keep_alive(connection, lost)
+            except (OSError, asyncpg.PostgresError, TimeoutError) as exc:
+                logger.warning(
+                    "Lost the cache invalidation listener connection",
+                    reason=repr(exc),
+                )
+            except Exception as exc:
+                # e.g. an asyncpg.InterfaceError, or add_listener failing.
+                # Reconnect and flush like for any lost connection
+                logger.error(
+                    "Lost the cache invalidation listener connection",
+                    exc_info=exc,
+                )
+            finally:
+                metrics.gauge("invalidation.connected", 0)
+                connection.terminate()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _keep_alive(
+        self,
+        connection: asyncpg.Connection,
+        lost: asyncio.Event,
+    ) -> None:
+        # a silently dropped TCP connection never terminates on its own
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), self.keepalive_interval)
+            except TimeoutError:
+                await connection.execute("SELECT 1", timeout=self.keepalive_interval)
+
+    def _on_notification(
+        self,
+        connection: Any,
+        pid: int,
+        channel: str,
+        payload: str,
+    ) -> None:
+        try:
+            notification = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.warning("Ignoring malformed cache invalidation", payload=payload)
+            return
+
+        if notification["origin"] == self.origin:
+            return
+
+        metrics.increment("invalidation.received")
+        for invalidator in self._invalidators.get(notification["topic"], []):
+            self._run(invalidator(notification["keys"]))
+
+    def _invalidate_all(self) -> None:
+        for invalidators in self._invalidators.values():
+            for invalidator in invalidators:
+                self._run(invalidator(None))
+
+    def _run(self, invalidation: Awaitable[None]) -> None:
+        async def run() -> None:
+            try:
+                await invalidation
+            except Exception as exc:
+                logger.error("Failed to invalidate a cache", exc_info=exc)
 
-        return None
+        task = asyncio.create_task(run())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
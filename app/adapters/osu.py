@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import time
+from io import BytesIO
+from typing import Any
+from typing import cast
+
+import aiohttp
+import aiosu
+import orjson
+from aiosu.events import ClientAddEvent
+from aiosu.events import ClientUpdateEvent
+from aiosu.exceptions import APIException
+from aiosu.exceptions import InvalidClientRequestedError
+from aiosu.models import OAuthToken
+from aiosu.v2.client import ClientRequestType
+from aiosu.v2.client import check_token
+from aiosu.v2.client import get_content_type
+from aiosu.v2.client import prepare_token
+from aiosu.v2.repository import SimpleTokenRepository
+from common import metrics
+
+
+def create_http_session(
+    max_connections: int,
+    max_connections_per_host: int,
+    keepalive_timeout: float,
+    dns_cache_ttl: int,
+) -> aiohttp.ClientSession:
+    """Create the pooled session shared by every osu! request in the process."""
+    connector = aiohttp.TCPConnector(
+        limit=max_connections,
+        limit_per_host=max_connections_per_host,
+        keepalive_timeout=keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_cache_ttl,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def _read_json(resp: aiohttp.ClientResponse) -> Any:
+    body = await resp.read()
+    content_type = get_content_type(resp.headers.get("content-type", ""))
+    if content_type != "application/json":
+        raise APIException(resp.status, f"Unhandled Content Type '{content_type}'")
+
+    json = orjson.loads(body)
+    if resp.status != 200:
+        raise APIException(resp.status, json.get("error", ""))
+
+    return json
+
+
+async def process_code(
+    http: aiohttp.ClientSession,
+    client_id: int,
+    client_secret: str,
+    redirect_uri: str,
+    code: str,
+    base_url: str = "https://osu.ppy.sh",
+) -> OAuthToken:
+    """Same as `aiosu.utils.auth.process_code`, over the shared session."""
+    async with http.post(
+        f"{base_url}/oauth/token",
+        headers={"Accept": "application/json"},
+        data={
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code",
+        },
+    ) as resp:
+        return OAuthToken.model_validate(await _read_json(resp))
+
+
+class Client(aiosu.v2.Client):
+    """aiosu client sending its requests through a shared HTTP session.
+
+    The stock client opens a new session (and therefore new TLS connections)
+    per client and per token refresh. Here the authorization header is sent
+    per request instead, so every client can reuse the same connection pool.
+    """
+
+    __slots__ = ("_http", "_headers")
+
+    def __init__(self, **kwargs: Any) -> None:
+        self._http: aiohttp.ClientSession = kwargs.pop("http")
+        self._headers: dict[str, str] | None = None
+        super().__init__(**kwargs)
+
+    async def _request(
+        self,
+        request_type: ClientRequestType,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        await self._prepare_token()
+
+        if self._headers is None:
+            self._headers = await self._get_headers()
+
+        async with self._limiter:
+            async with self._http.request(
+                request_type,
+                *args,
+                headers=self._headers,
+                **kwargs,
+            ) as resp:
+                if resp.status == 204:
+                    return
+
+                body = await resp.read()
+                content_type = get_content_type(resp.headers.get("content-type", ""))
+                if resp.status != 200:
+                    json = {}
+                    if content_type == "application/json":
+                        json = orjson.loads(body)
+                    raise APIException(resp.status, json.get("error", ""))
+                if content_type == "application/json":
+                    return orjson.loads(body)
+                if content_type == "application/octet-stream":
+                    return BytesIO(body)
+                if content_type.startswith("application/x-osu"):
+                    return BytesIO(body)
+                if content_type == "text/plain":
+                    return body.decode()
+                raise APIException(
+                    resp.status,
+                    f"Unhandled Content Type '{content_type}'",
+                )
+
+    async def _refresh(self) -> None:
+        old_token = await self.get_current_token()
+
+        if old_token.can_refresh:
+            data = await self._refresh_auth_data()
+        else:
+            data = self._refresh_guest_data()
+
+        async with self._limiter:
+            async with self._http.post(
+                f"{self.base_url}/oauth/token",
+                json=data,
+            ) as resp:
+                new_token = OAuthToken.model_validate(await _read_json(resp))
+
+        await self._update_token(new_token)
+        self._headers = None
+
+        await self._process_event(
+            ClientUpdateEvent(client=self, old_token=old_token, new_token=new_token),
+        )
+
+    @prepare_token
+    @check_token
+    async def revoke_token_remote(self) -> None:
+        """Revoke the token on osu!'s side only.
+
+        Unlike `revoke_token`, the token repository is left alone so callers
+        can clear tokens in their own writes, outside of the osu! breaker.
+        """
+        await self._request("DELETE", f"{self.base_url}/api/v2/oauth/tokens/current")
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        # the shared session belongs to the app lifecycle, not to the client
+        self._headers = None
+
+
+class ClientStorage(aiosu.v2.ClientStorage):
+    """aiosu client storage bounded in size and idle time.
+
+    Clients are kept in least recently used order. Whenever the storage is
+    used, clients idle for longer than `idle_ttl` seconds are dropped, and the
+    least recently used ones are dropped past `max_clients`. Dropping a client
+    doesn't revoke its token, the next `get_client` reloads it from the token
+    repository.
+
+    The client credentials app client is kept apart from user clients, its
+    requests are limited to `app_limiter` (requests, seconds).
+    """
+
+    __slots__ = (
+        "_http",
+        "_max_clients",
+        "_idle_ttl",
+        "_app_limiter",
+        "_last_used",
+        "_app_client",
+    )
+
+    def __init__(self, **kwargs: Any) -> None:
+        self._http: aiohttp.ClientSession = kwargs.pop("http")
+        self._max_clients: int = kwargs.pop("max_clients")
+        self._idle_ttl: float = kwargs.pop("idle_ttl")
+        self._app_limiter: tuple[int, int] = kwargs.pop("app_limiter")
+        super().__init__(**kwargs)
+        self._last_used: dict[int, float] = {}
+        self._app_client: Client | None = None
+
+    @property
+    async def app_client(self) -> Client:
+        if self._app_client is None:
+            # its token lives in memory only, a new one is requested on startup
+            self._app_client = Client(
+                http=self._http,
+                token_repository=SimpleTokenRepository(),
+                session_id=0,
+                token=OAuthToken(),
+                limiter=self._app_limiter,
+                **self._get_client_args(),
+            )
+
+        return self._app_client
+
+    async def add_client(self, token: OAuthToken, **kwargs: Any) -> Client:
+        session_id: int = kwargs.pop("id", token.owner_id)
+        client = Client(
+            http=self._http,
+            token_repository=self._token_repository,
+            session_id=session_id,
+            token=token,
+            **self._get_client_args(),
+        )
+        client._register_listener(self._process_event, ClientUpdateEvent)
+        await client._prepare_token()
+        await self._process_event(
+            ClientAddEvent(session_id=session_id, client=client),
+        )
+        self.clients[session_id] = client
+        return client
+
+    async def get_client(self, **kwargs: Any) -> Client:
+        await self._evict(idle_only=True)
+
+        client = cast(Client, await super().get_client(**kwargs))
+        # dicts keep insertion order, re-inserting marks it most recently used
+        self.clients[client.session_id] = self.clients.pop(client.session_id)
+        self._last_used[client.session_id] = time.monotonic()
+
+        await self._evict(idle_only=False)
+        return client
+
+    async def revoke_client(self, client_uid: int) -> None:
+        # take the client out before awaiting, so a concurrent eviction
+        # can't remove it from under us
+        client = self.clients.pop(client_uid, None)
+        if client is None:
+            raise InvalidClientRequestedError("No client exists with the given ID.")
+
+        self._last_used.pop(client_uid, None)
+        metrics.gauge("osu.clients.live", len(self.clients))
+
+        await client.revoke_token()
+
+    async def take_client(self, client_uid: int) -> Client:
+        """Load a client and take it out of the storage, ahead of revoking it.
+
+        Unlike `revoke_client` nothing is sent to osu!, so callers can keep
+        loading the token apart from the request revoking it, see
+        `Client.revoke_token_remote`.
+        """
+        client = await self.get_client(id=client_uid)
+        self.clients.pop(client_uid, None)
+        self._last_used.pop(client_uid, None)
+        metrics.gauge("osu.clients.live", len(self.clients))
+        return client
+
+    async def forget_clients(self, session_ids: list[int] | None) -> None:
+        """Drop clients whose token may have changed elsewhere, None drops all.
+
+        Like evictions, this doesn't revoke anything: the next `get_client`
+        reloads the token from the token repository.
+        """
+        if session_ids is None:
+            session_ids = list(self.clients)
+
+        for session_id in session_ids:
+            client = self.clients.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+            if client is not None:
+                await client.aclose()
+                metrics.increment("osu.clients.evicted.invalidated")
+
+        metrics.gauge("osu.clients.live", len(self.clients))
+
+    async def _evict(self, idle_only: bool) -> None:
+        idle_since = time.monotonic() - self._idle_ttl
+
+        while self.clients:
+            session_id = next(iter(self.clients))
+
+            if self._last_used.get(session_id, 0) < idle_since:
+                reason = "idle"
+            elif not idle_only and len(self.clients) > self._max_clients:
+                reason = "capacity"
+            else:
+                break
+
+            client = self.clients.pop(session_id)
+            self._last_used.pop(session_id, None)
+            await client.aclose()
+            metrics.increment(f"osu.clients.evicted.{reason}")
+
+        metrics.gauge("osu.clients.live", len(self.clients))
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import csv
+import io
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Literal
+
+import orjson
+from api.internal.security import require_internal_key
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from repositories.users import VerifiedLink
+from services import users
+
+# rows serialized per chunk sent to the client
+_CHUNK_SIZE = 500
+
+_COLUMNS = ("discord_id", "osu_id", "osu_username", "verified", "updated_at")
+
+export_router = APIRouter(
+    prefix="/internal",
+    dependencies=[Depends(require_internal_key)],
+    default_response_class=Response,
+)
+
+
+async def _chunks(
+    links: AsyncIterator[VerifiedLink],
+) -> AsyncIterator[list[VerifiedLink]]:
+    chunk = []
+    async for link in links:
+        chunk.append(link)
+        if len(chunk) >= _CHUNK_SIZE:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+async def _ndjson(links: AsyncIterator[VerifiedLink]) -> AsyncIterator[bytes]:
+    async for chunk in _chunks(links):
+        yield b"".join(
+            orjson.dumps(link, option=orjson.OPT_APPEND_NEWLINE) for link in chunk
+        )
+
+
+async def _csv(links: AsyncIterator[VerifiedLink]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_COLUMNS)
+
+    async for chunk in _chunks(links):
+        writer.writerows(
+            (
+                link["discord_id"],
+                link["osu_id"],
+                link["osu_username"],
+                "true" if link["verified"] else "false",
+                link["updated_at"].isoformat(),
+            )
+            for link in chunk
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # only the header is left when there were no rows
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@export_router.get("/export")
+async def export_handler(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    updated_since: datetime | None = None,
+) -> Response:
+    """Stream every verified discord <-> osu! link, with bounded memory.
+
+    Rows come from a server-side cursor and are sent as they're read. Pass
+    the time the previous export started as `updated_since` to only get the
+    links that changed since, and tombstones (`verified` false) for the ones
+    removed since.
+    """
+    links = users.iterate_verified_links(updated_since)
+
+    if format == "csv":
+        return StreamingResponse(
+            _csv(links),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="links.csv"'},
+        )
+
+    return StreamingResponse(_ndjson(links), media_type="application/x-ndjson")
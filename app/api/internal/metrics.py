@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from api.internal.security import require_internal_key
+from common import metrics
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+metrics_router = APIRouter(
+    prefix="/internal",
+    dependencies=[Depends(require_internal_key)],
+    default_response_class=Response,
+)
+
+
+@metrics_router.get("/metrics")
+async def metrics_handler() -> Response:
+    return JSONResponse(metrics.snapshot())
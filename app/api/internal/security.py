@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import secrets
+
+from common import settings
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import status
+
+
+async def require_internal_key(
+    x_internal_key: str = Header(default=""),
+) -> None:
+    """Only let through requests from our own services."""
+    if not settings.INTERNAL_API_KEY or not secrets.compare_digest(
+        x_internal_key,
+        settings.INTERNAL_API_KEY,
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid internal key",
+        )
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from api.internal.security import require_internal_key
+from common.errors import ServiceError
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Response
+from fastapi import status
+from fastapi.responses import JSONResponse
+from services import users
+
+verified_router = APIRouter(
+    prefix="/internal",
+    dependencies=[Depends(require_internal_key)],
+    default_response_class=Response,
+)
+
+
+@verified_router.get("/verified/{discord_id}")
+async def verified_handler(discord_id: str) -> Response:
+    # answered from the in-memory index, never from the database
+    osu_id = await users.fetch_verified_osu_id(discord_id)
+
+    if isinstance(osu_id, ServiceError):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not a verified user",
+        )
+
+    return JSONResponse({"discord_id": discord_id, "osu_id": str(osu_id)})
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from adapters import database
+from starlette.types import ASGIApp
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+
+class RequestDeadlineMiddleware:
+    """Gives the database queries of each request `timeout` seconds in total.
+
+    See `adapters.database.deadline`. Written as plain ASGI so the deadline
+    is set in the context the endpoint runs in.
+    """
+
+    def __init__(self, app: ASGIApp, timeout: float) -> None:
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.timeout:
+            await self.app(scope, receive, send)
+            return
+
+        with database.deadline(self.timeout):
+            await self.app(scope, receive, send)
@@ -4,13 +4,18 @@ from typing import cast
 from uuid import uuid4
 
 from aiosu.utils import auth
+from api.osu.models import PublicUser
 from api.osu.models import User as UserModel
+from api.osu.models import dump_json
 from common import clients
 from common import logger
 from common import settings
 from common.errors import ServiceError
 from common.session_backend import DatabaseBackend
+from common.session_token import new_claims
+from common.session_token import SessionTokenCookie
 from common.session_verifier import BasicVerifier
+from common.session_verifier import StatelessVerifier
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi import HTTPException
@@ -42,6 +47,23 @@ cookie_verifier = BasicVerifier(
     auth_http_exception=HTTPException(status_code=403, detail="Invalid session"),
 )
 
+# stateless mode: the cookie carries signed claims, see common.session_token
+token_cookie = SessionTokenCookie(
+    cookie_name=settings.SESSION_COOKIE_NAME,
+    identifier=settings.SESSION_COOKIE_IDENTIFIER,
+    auto_error=True,
+    secret_key=settings.SESSION_COOKIE_KEY,
+    cookie_params=CookieParameters(max_age=settings.SESSION_TOKEN_MAX_AGE),
+)
+
+token_verifier = StatelessVerifier(
+    identifier=settings.SESSION_COOKIE_IDENTIFIER,
+    auth_http_exception=HTTPException(status_code=403, detail="Invalid session"),
+)
+
+STATELESS_SESSIONS = settings.SESSION_MODE == "stateless"
+session_cookie = token_cookie if STATELESS_SESSIONS else cookie
+
 
 def determine_status_code(error: ServiceError) -> int:
     match error:
@@ -51,7 +73,17 @@ def determine_status_code(error: ServiceError) -> int:
             return status.HTTP_409_CONFLICT
         case ServiceError.USER_NOT_VERIFIED:
             return status.HTTP_403_FORBIDDEN
-        case ServiceError.INTERNAL_SERVER_ERROR:
+        case ServiceError.VERIFICATION_CODE_EXPIRED:
+            return status.HTTP_410_GONE
+        case ServiceError.RATE_LIMITED:
+            return status.HTTP_429_TOO_MANY_REQUESTS
+        case (
+            ServiceError.OSU_AUTH_UNAVAILABLE
+            | ServiceError.OSU_API_UNAVAILABLE
+            | ServiceError.DISCORD_UNAVAILABLE
+        ):
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+        case ServiceError.INTERNAL_SERVER_ERROR | ServiceError.GUILD_NOT_CONFIGURED:
             return status.HTTP_500_INTERNAL_SERVER_ERROR
         case _:
             logger.warning(
@@ -61,17 +93,66 @@ def determine_status_code(error: ServiceError) -> int:
             return status.HTTP_500_INTERNAL_SERVER_ERROR
 
 
+async def session_discord_id(request: Request) -> str:
+    """discord id of the session's user, without any lookup in stateless mode."""
+    if STATELESS_SESSIONS:
+        claims = await token_verifier(request)
+        return claims["discord_id"]
+
+    user: User = await cookie_verifier(request)
+    return user["discord_id"]
+
+
+def _not_verified(user: User | ServiceError) -> bool:
+    return user is ServiceError.USER_NOT_FOUND or (
+        not isinstance(user, ServiceError) and not user["verified"]
+    )
+
+
+async def session_user(request: Request) -> User:
+    if not STATELESS_SESSIONS:
+        return cast(User, await cookie_verifier(request))
+
+    claims = await token_verifier(request)
+    user = await users.fetch_by_user_id(claims["user_id"])
+    # a replica may not have seen the /auth that issued the token yet;
+    # revoked tokens are caught by the verifier, not by this row
+    if _not_verified(user):
+        user = await users.fetch_by_user_id(claims["user_id"], primary=True)
+
+    if _not_verified(user):
+        raise token_verifier.auth_http_exception
+
+    if isinstance(user, ServiceError):
+        status_code = determine_status_code(user)
+        raise HTTPException(status_code=status_code, detail="Failed to fetch user")
+
+    return user
+
+
 @auth_router.post("/auth")
 async def auth_handler(request: Request) -> Response:
+    client_ip = request.client.host if request.client is not None else "unknown"
+    if not clients.auth_ip_limiter.allow(client_ip):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
     body = await request.json()
-    # TODO: Maybe also validate if both codes aren't empty
-    if "kohaku_code" not in body or "osu_code" not in body:
+    kohaku_code = body.get("kohaku_code") if isinstance(body, dict) else None
+    osu_code = body.get("osu_code") if isinstance(body, dict) else None
+    # codes are rate limit keys, anything but a non-empty string is refused first
+    if not isinstance(kohaku_code, str) or not isinstance(osu_code, str):
         raise HTTPException(status_code=400, detail="Missing codes in request body")
 
+    if not kohaku_code or not osu_code:
+        raise HTTPException(status_code=400, detail="Empty codes in request body")
+
+    if not clients.auth_code_limiter.allow(kohaku_code):
+        raise HTTPException(status_code=429, detail="Too many requests")
+
     session_id = uuid4()
     user = await users.verify(
-        kohaku_code=body["kohaku_code"],
-        osu_code=body["osu_code"],
+        kohaku_code=kohaku_code,
+        osu_code=osu_code,
         session_id=session_id,
     )
 
@@ -79,11 +160,20 @@ async def auth_handler(request: Request) -> Response:
         status_code = determine_status_code(user)
         raise HTTPException(status_code=status_code, detail="Failed to verify user")
 
-    user_mdl = UserModel.model_validate(user)
-    await cookie_backend.create(session_id=session_id, data=user_mdl)
+    response = Response(
+        dump_json(UserModel, user),
+        status_code=200,
+        media_type="application/json",
+    )
 
-    response = Response(user_mdl.json(), status_code=200, media_type="application/json")
-    cookie.attach_to_response(response, session_id)
+    if STATELESS_SESSIONS:
+        token_cookie.attach_to_response(
+            response,
+            new_claims(user["user_id"], user["discord_id"]),
+        )
+    else:
+        await cookie_backend.create(session_id=session_id, data=user)
+        cookie.attach_to_response(response, session_id)
 
     logger.info(
         f"User {user['discord_username']} ({user['discord_id']}) with osu! account {user['osu_username']} ({user['osu_id']}) verified successfully",
@@ -92,16 +182,9 @@ async def auth_handler(request: Request) -> Response:
     return response
 
 
-@auth_router.post("/deauth", dependencies=[Depends(cookie)])
-async def deauth_handler(
-    user: UserModel = Depends(cookie_verifier),
-) -> Response:
-    if isinstance(user, ServiceError):
-        status_code = determine_status_code(user)
-        raise HTTPException(status_code=status_code, detail="Failed to verify user")
-
-    _user = cast(User, dict(user))
-    _user = await users.remove_verification(_user["discord_id"], True)  # type: ignore
+@auth_router.post("/deauth", dependencies=[Depends(session_cookie)])
+async def deauth_handler(discord_id: str = Depends(session_discord_id)) -> Response:
+    _user = await users.remove_verification(discord_id, True)
 
     if isinstance(_user, ServiceError):
         status_code = determine_status_code(_user)
@@ -110,15 +193,53 @@ async def deauth_handler(
             detail="Failed to remove verification",
         )
 
-    await cookie_backend.delete(session_id=_user["session_id"])  # type: ignore
+    response = Response(status_code=200)
+    if STATELESS_SESSIONS:
+        # remove_verification revoked the token, the cookie is dead weight
+        token_cookie.delete_from_response(response)
+    else:
+        await cookie_backend.delete(session_id=_user["session_id"])  # type: ignore
 
     logger.info(
         f"User {_user['discord_username']} ({_user['discord_id']}) with osu! account {_user['osu_username']} ({_user['osu_id']}) deauthenticated successfully",
     )
 
-    return Response(status_code=200)
+    return response
+
+
+def _etag(user: User) -> str:
+    # every write to a user moves updated_at, which postgres keeps in microseconds
+    return f'W/"{user["user_id"]}-{int(user["updated_at"].timestamp() * 1_000_000)}"'
 
 
-@auth_router.get("/user", dependencies=[Depends(cookie)])
-async def user_handler(user: UserModel = Depends(cookie_verifier)) -> Response:
-    return Response(user.json(), media_type="application/json")
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    # If-None-Match is compared weakly
+    return etag.removeprefix("W/") in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    )
+
+
+@auth_router.get(
+    "/user",
+    dependencies=[Depends(session_cookie)],
+    responses={200: {"model": PublicUser}, 304: {"description": "Not modified"}},
+)
+async def user_handler(
+    request: Request,
+    user: User = Depends(session_user),
+) -> Response:
+    headers = {"ETag": _etag(user), "Cache-Control": "private, no-cache"}
+    if _etag_matches(headers["ETag"], request.headers.get("If-None-Match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(
+        dump_json(PublicUser, user),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from api.internal.security import require_internal_key
+from api.osu.auth import determine_status_code
+from api.osu.models import LookupRequest
+from common import settings
+from common.errors import ServiceError
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from services import users
+
+lookup_router = APIRouter(
+    dependencies=[Depends(require_internal_key)],
+    default_response_class=Response,
+)
+
+
+@lookup_router.post("/lookup")
+async def lookup_handler(body: LookupRequest) -> Response:
+    """Resolve many discord ids to osu! accounts in a single query.
+
+    Responds with `[[discord_id, osu_id, osu_username], ...]` for the
+    verified users among them, in no particular order.
+    """
+    discord_ids = list(dict.fromkeys(body.discord_ids))
+    if len(discord_ids) > settings.LOOKUP_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.LOOKUP_MAX_BATCH_SIZE} discord ids per request",
+        )
+
+    _users = await users.fetch_many_by_discord_ids(discord_ids)
+
+    if isinstance(_users, ServiceError):
+        status_code = determine_status_code(_users)
+        raise HTTPException(status_code=status_code, detail="Failed to look up users")
+
+    return JSONResponse(
+        [
+            [user["discord_id"], user["osu_id"], user["osu_username"]]
+            for user in _users
+            if user["verified"]
+        ],
+    )
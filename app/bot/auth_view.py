@@ -1,16 +1,81 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import os
 
 import discord
+from common import clients
 from common import logger
+from common import metrics
 from common import settings
 from common.errors import ServiceError
-from discord import Client
-from discord import InteractionCallbackResponse
 from services import users
 
+TIMED_OUT_MESSAGE = "This is taking longer than usual, please try again in a moment."
+FAILED_MESSAGE = "Something went wrong, please try again later."
+
+
+def _age(interaction: discord.Interaction) -> float:
+    """Seconds since the user clicked, as far as Discord is concerned."""
+    return (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+
+def _new_verification_code() -> str:
+    return base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
+
+
+async def _verification_message(
+    member: discord.User | discord.Member,
+    guild_id: int | None,
+) -> str:
+    user = await users.fetch_by_discord_id(str(member.id))
+
+    if isinstance(user, ServiceError):
+        if user is not ServiceError.USER_NOT_FOUND:
+            return FAILED_MESSAGE
+
+        logger.info(f"User {member.name} ({member.id}) not found. Creating...")
+
+        code = _new_verification_code()
+        created = await users.create(
+            discord_id=str(member.id),
+            discord_username=member.name,
+            verified=False,
+            verification_code=code,
+            verification_code_expires_on=users.verification_code_expiry(),
+            guild_id=str(guild_id) if guild_id is not None else None,
+        )
+        if isinstance(created, ServiceError):
+            return FAILED_MESSAGE
+
+        return f"To verify, go to: {settings.FRONTEND_URL}?kohaku_code={code}"
+
+    if user["verified"]:
+        logger.info(f"User {member.name} ({member.id}) tried to verify again")
+        # they may have verified through another guild, which gave them
+        # that guild's role only
+        if guild_id is not None:
+            granted = await users.grant_verified_role(user, guild_id)
+            if isinstance(granted, ServiceError):
+                return FAILED_MESSAGE
+
+        return "You're already verified!"
+
+    code = _new_verification_code()
+    updated = await users.partial_update(
+        user_id=user["user_id"],
+        verification_code=code,
+        verification_code_expires_on=users.verification_code_expiry(),
+        discord_username=member.name,
+        # the role is given in the guild the button was clicked in
+        guild_id=str(guild_id) if guild_id is not None else None,
+    )
+    if isinstance(updated, ServiceError):
+        return FAILED_MESSAGE
+
+    return f"To verify, go to: {settings.FRONTEND_URL}?kohaku_code={code}"
+
 
 class AuthenticationView(discord.ui.View):
     # Make the button persistent
@@ -27,50 +92,34 @@ class AuthenticationView(discord.ui.View):
         self,
         interaction: discord.Interaction,
         button: discord.ui.Button,  # type: ignore
-    ) -> InteractionCallbackResponse[Client]:
-        user = await users.fetch_by_discord_id(str(interaction.user.id))
-
-        if isinstance(user, ServiceError):
-            if user is ServiceError.USER_NOT_FOUND:
-                logger.info(
-                    f"User {interaction.user.name} ({interaction.user.id}) not found. Creating...",
-                )
-
-                code = (
-                    base64.urlsafe_b64encode(os.urandom(32))
-                    .rstrip(b"=")
-                    .decode("ascii")
-                )
-
-                user = await users.create(
-                    discord_id=str(interaction.user.id),
-                    discord_username=interaction.user.name,
-                    verified=False,
-                    verification_code=code,
-                )
-
-                return await interaction.response.send_message(
-                    f"To verify, go to: {settings.FRONTEND_URL}?kohaku_code={code}",
-                    ephemeral=True,
-                )
-
-        if user["verified"]:  # type: ignore
-            logger.info(
-                f"User {interaction.user.name} ({interaction.user.id}) tried to verify again",
-            )
-            return await interaction.response.send_message(
-                "You're already verified!",
+    ) -> None:
+        if not clients.verify_button_limiter.allow(str(interaction.user.id)):
+            await interaction.response.send_message(
+                "You're clicking too fast, please try again in a minute.",
                 ephemeral=True,
             )
-        else:
-            code = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
+            return
 
-            user = await users.partial_update(
-                user_id=user["user_id"],  # type: ignore
-                verification_code=code,
-            )
+        # Discord fails the interaction if it isn't acknowledged within 3
+        # seconds, so acknowledge first and answer with a followup once the
+        # database work is done.
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        metrics.observe("verify_button.time_to_ack", _age(interaction))
 
-            return await interaction.response.send_message(
-                f"To verify, go to: {settings.FRONTEND_URL}?kohaku_code={code}",
-                ephemeral=True,
+        try:
+            async with asyncio.timeout(settings.VERIFY_BUTTON_LATENCY_BUDGET):
+                message = await _verification_message(
+                    interaction.user,
+                    interaction.guild_id,
+                )
+        except TimeoutError:
+            metrics.increment("verify_button.budget_exceeded")
+            logger.warning(
+                "Verify button ran out of time",
+                discord_id=interaction.user.id,
+                budget=settings.VERIFY_BUTTON_LATENCY_BUDGET,
             )
+            message = TIMED_OUT_MESSAGE
+
+        await interaction.followup.send(message, ephemeral=True)
+        metrics.observe("verify_button.time_to_followup", _age(interaction))
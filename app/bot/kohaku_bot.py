@@ -1,86 +1,171 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from datetime import datetime
+from datetime import timezone
 from typing import Any
 
 import discord
 from bot.auth_view import AuthenticationView
+from common import clients
 from common import logger
+from common import metrics
+from common import settings
 from common.errors import ServiceError
+from repositories import bot_state
+from repositories import guilds
+from repositories.guilds import Guild
 from services import users
 
 
-class Bot(discord.Client):
-    def __init__(
-        self: Any,
-        verify_channel_id: int,
-        guild_id: int,
-        *args: Any,
-        **kwargs: Any,
-    ) -> None:
+class Bot(discord.AutoShardedClient):
+    """The kohaku bot, serving every guild in the guilds table.
+
+    The guild configurations are cached in memory, and reloaded whenever the
+    bot (re)connects.
+    """
+
+    def __init__(self: Any, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
-        self.guild_id = guild_id
-        self.verify_channel_id = verify_channel_id
+        self.guild_configs: dict[int, Guild] = {}
+        # guild id -> id of the message holding its verification button
+        self.verify_message_ids: dict[int, int] = {}
+
+        # guild id -> discord id -> name of members who left and haven't
+        # been handled yet
+        self.leaving_members: dict[int, dict[str, str]] = {}
+        self.leaving_members_flush: asyncio.Task[None] | None = None
+
+        # discord id -> latest username, not written to the database yet
+        self.username_changes: dict[str, str] = {}
+        self.username_changes_flush: asyncio.Task[None] | None = None
 
     async def start(self, *args: Any, **kwargs: Any) -> None:
         await super().start(*args, **kwargs)
 
     async def close(self, *args: Any, **kwargs: Any) -> None:
+        for flush in (self.leaving_members_flush, self.username_changes_flush):
+            if flush is not None:
+                flush.cancel()
+        self.leaving_members_flush = self.username_changes_flush = None
+
+        await self.flush_leaving_members()
+        await self.flush_username_changes()
         await super().close(*args, **kwargs)
 
-    async def setup_verify_channel(self) -> None:
+    async def setup_hook(self) -> None:
+        await self.load_guild_configs()
+        clients.invalidation_bus.subscribe(guilds.CACHE_TOPIC, self._on_guilds_changed)
+
+        # Register persistent view
         self.add_view(AuthenticationView())
         logger.info("Persistent button registered")
 
-        channel = self.get_channel(self.verify_channel_id)
+    async def load_guild_configs(self) -> None:
+        self.guild_configs = {
+            int(guild["guild_id"]): guild for guild in await guilds.fetch_all()
+        }
+        logger.info(f"Loaded the configuration of {len(self.guild_configs)} guild(s)")
 
-        if isinstance(channel, discord.TextChannel):
-            latest_messages = [message async for message in channel.history(limit=100)]
+    async def _on_guilds_changed(self, keys: list[str] | None) -> None:
+        # there's a handful of guilds, reloading all of them is simplest
+        await self.load_guild_configs()
 
-            for message in latest_messages:
-                assert self.user is not None
+    def verified_role_id(self, guild_id: int | None) -> int | None:
+        if guild_id is None or (config := self.guild_configs.get(guild_id)) is None:
+            return None
 
-                if message.author.id == self.user.id and len(message.components) > 0:
-                    logger.info(
-                        "Found an already existing button for verification. The bot will not create a new one",
-                    )
-                    return
+        return int(config["verified_role_id"])
 
-            await channel.send("", view=AuthenticationView())
-            logger.info("Verification button created")
+    async def setup_verify_channels(self) -> None:
+        for guild_id, config in self.guild_configs.items():
+            # on_ready fires again on every gateway reconnect, the button
+            # only needs to be looked for once per process
+            if guild_id in self.verify_message_ids:
+                continue
 
-    async def give_role(self, user_id: int, role_id: int) -> None:
-        guild = self.get_guild(self.guild_id)
+            channel = self.get_channel(int(config["verify_channel_id"]))
 
-        assert guild is not None
+            # also None for guilds on shards run by other processes
+            if isinstance(channel, discord.TextChannel):
+                await self.setup_verify_channel(guild_id, channel)
+
+    async def setup_verify_channel(
+        self,
+        guild_id: int,
+        channel: discord.TextChannel,
+    ) -> None:
+        message = await self._find_verify_message(guild_id, channel)
 
-        discord_member = await guild.fetch_member(user_id)
-        role = guild.get_role(role_id)
+        if message is not None:
+            logger.info(
+                "Found an already existing button for verification. The bot will not create a new one",
+                guild_id=guild_id,
+            )
+        else:
+            message = await channel.send("", view=AuthenticationView())
+            logger.info("Verification button created", guild_id=guild_id)
 
-        assert discord_member is not None
-        assert role is not None
+        self.verify_message_ids[guild_id] = message.id
+        await bot_state.upsert(
+            bot_state.verify_message_id_key(guild_id),
+            str(message.id),
+        )
 
-        await discord_member.remove_roles(role)
-        await discord_member.add_roles(role)
+    async def _find_verify_message(
+        self,
+        guild_id: int,
+        channel: discord.TextChannel,
+    ) -> discord.Message | None:
+        stored_id = await bot_state.fetch_value(
+            bot_state.verify_message_id_key(guild_id),
+        )
 
-    async def remove_role(self, user_id: int, role_id: int) -> None:
-        guild = self.get_guild(self.guild_id)
+        if stored_id is not None:
+            try:
+                return await channel.fetch_message(int(stored_id))
+            except discord.NotFound:
+                logger.info(
+                    "The stored verification message was deleted",
+                    guild_id=guild_id,
+                )
+                return None
 
-        assert guild is not None
+        # Nothing stored yet (new guild, or first start after upgrading), look
+        # for a button posted by an earlier version once, it's remembered
+        # afterwards.
+        assert self.user is not None
+        async for message in channel.history(limit=100):
+            if message.author.id == self.user.id and len(message.components) > 0:
+                return message
 
-        discord_member = await guild.fetch_member(user_id)
-        role = guild.get_role(role_id)
+        return None
 
-        assert discord_member is not None
-        assert role is not None
+    async def give_role(self, guild_id: int, user_id: int, role_id: int) -> None:
+        # the guild may be on a shard run by another process, so it's not
+        # looked up in the gateway cache; an unknown member still raises
+        # discord.NotFound, like fetch_member did
+        await self.http.add_role(guild_id, user_id, role_id)
 
-        await discord_member.remove_roles(role)
+    async def remove_role(self, guild_id: int, user_id: int, role_id: int) -> None:
+        await self.http.remove_role(guild_id, user_id, role_id)
 
     async def on_ready(self) -> None:
-        # Register persistent view
-        await self.setup_verify_channel()
+        # pick up guilds added while we were disconnected
+        await self.load_guild_configs()
+        await self.setup_verify_channels()
+        await bot_state.upsert(
+            bot_state.LAST_READY_AT,
+            datetime.now(timezone.utc).isoformat(),
+        )
 
         assert self.user is not None
-        logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        logger.info(
+            f"Logged in as {self.user} (ID: {self.user.id})",
+            shard_ids=self.shard_ids,
+            shard_count=self.shard_count,
+        )
 
     async def on_message(self, message: discord.Message) -> None:
         ignore = not message.guild
@@ -89,22 +174,101 @@ class Bot(discord.Client):
         if ignore:
             return
 
-    async def on_member_remove(self, member: discord.Member) -> None:
-        user = await users.fetch_by_discord_id(str(member.id))
+    async def on_user_update(self, before: discord.User, after: discord.User) -> None:
+        if before.name == after.name:
+            return
 
-        if isinstance(user, ServiceError):
-            logger.info(
-                f"The non-verified user {member.name} ({member.id}) left the server. Ignoring...",
+        # rename waves would otherwise cost a write per event, only the
+        # latest name of each user is kept and they're written together
+        self.username_changes[str(after.id)] = after.name
+
+        if len(self.username_changes) >= settings.DISCORD_USERNAME_BATCH_MAX_SIZE:
+            await self.flush_username_changes()
+        elif self.username_changes_flush is None:
+            self.username_changes_flush = asyncio.create_task(
+                self._flush_username_changes_later(),
             )
+
+    async def _flush_username_changes_later(self) -> None:
+        await asyncio.sleep(settings.DISCORD_USERNAME_FLUSH_INTERVAL)
+        self.username_changes_flush = None
+        await self.flush_username_changes()
+
+    async def flush_username_changes(self) -> None:
+        changes, self.username_changes = self.username_changes, {}
+        if not changes:
             return
 
-        if user["verified"]:
-            await users.remove_verification(str(member.id), False)
+        with metrics.timed("username_update.drain_time"):
+            result = await users.update_discord_usernames(changes)
+        metrics.observe("username_update.batch_size", len(changes))
+
+        if isinstance(result, ServiceError):
+            logger.error(
+                "Failed to save discord username changes",
+                service_error=result,
+                users=len(changes),
+            )
+
+    async def on_member_remove(self, member: discord.Member) -> None:
+        if member.guild.id not in self.guild_configs:
+            return
+
+        # raids cleanups and prunes make hundreds of members leave within
+        # seconds, so leaves are collected and handled in batches
+        self.leaving_members.setdefault(member.guild.id, {})[
+            str(member.id)
+        ] = member.name
+
+        pending = sum(len(members) for members in self.leaving_members.values())
+        if pending >= settings.MEMBER_REMOVE_BATCH_MAX_SIZE:
+            await self.flush_leaving_members()
+        elif self.leaving_members_flush is None:
+            self.leaving_members_flush = asyncio.create_task(
+                self._flush_leaving_members_later(),
+            )
+
+    async def _flush_leaving_members_later(self) -> None:
+        await asyncio.sleep(settings.MEMBER_REMOVE_BATCH_WINDOW)
+        self.leaving_members_flush = None
+        await self.flush_leaving_members()
 
+    async def flush_leaving_members(self) -> None:
+        leaving_members, self.leaving_members = self.leaving_members, {}
+
+        for guild_id, members in leaving_members.items():
+            await self._remove_verifications_of_members(guild_id, members)
+
+    async def _remove_verifications_of_members(
+        self,
+        guild_id: int,
+        members: dict[str, str],
+    ) -> None:
+        started_at = time.perf_counter()
+        verified_users = await users.remove_verifications_of_members(
+            guild_id,
+            list(members),
+        )
+        metrics.observe("member_remove.batch_size", len(members))
+        metrics.observe("member_remove.drain_time", time.perf_counter() - started_at)
+
+        if isinstance(verified_users, ServiceError):
+            logger.error(
+                "Failed to handle members who left the server",
+                service_error=verified_users,
+                guild_id=guild_id,
+                members=len(members),
+            )
+            return
+
+        for user in verified_users:
             logger.info(
-                f"The verified user {member.name} ({member.id}) left the server. Verification removed.",
+                f"The verified user {members[user['discord_id']]} ({user['discord_id']}) left the server. Verification removed.",
+                guild_id=guild_id,
             )
-        else:
+
+        if ignored := len(members) - len(verified_users):
             logger.info(
-                f"The non-verified user {member.name} ({member.id}) left the server. Ignoring...",
+                f"{ignored} non-verified user(s) left the server. Ignoring...",
+                guild_id=guild_id,
             )
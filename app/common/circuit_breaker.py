@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from enum import Enum
+
+from common import logger
+from common import metrics
+from common.errors import ServiceError
+
+
+class CircuitState(int, Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class DependencyUnavailableError(Exception):
+    """Raised instead of calling (or waiting on) a dependency that is down."""
+
+    def __init__(self, breaker: CircuitBreaker, reason: str) -> None:
+        super().__init__(f"{breaker.name} is unavailable ({reason})")
+        self.service_error = breaker.service_error
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Fail fast on a dependency after repeated failures or timeouts.
+
+    Every call made under `guard()` gets `call_timeout` seconds. After
+    `failure_threshold` consecutive failures the circuit opens, and calls are
+    rejected right away for `reset_timeout` seconds. Then up to
+    `half_open_max_calls` probe calls go through: a success closes the
+    circuit again, a failure reopens it.
+
+    `is_failure` tells dependency failures apart from errors that are the
+    caller's fault (e.g. an invalid osu! code), which don't trip the circuit.
+    Errors in `passthrough` (e.g. from the database, when a token refresh
+    writes it) say nothing about the dependency, and are re-raised as is.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        service_error: ServiceError,
+        is_failure: Callable[[BaseException], bool],
+        call_timeout: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_max_calls: int = 1,
+        passthrough: tuple[type[BaseException], ...] = (),
+    ) -> None:
+        self.name = name
+        self.service_error = service_error
+        self.is_failure = is_failure
+        self.call_timeout = call_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.passthrough = passthrough
+
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state is not self.state:
+            logger.warning(
+                "Circuit breaker changed state",
+                breaker=self.name,
+                old_state=self.state.name,
+                new_state=state.name,
+            )
+
+        self.state = state
+        metrics.gauge(f"circuit.{self.name}.state", state.value)
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would currently be let through."""
+        if self.state is CircuitState.OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+
+        if self.state is CircuitState.HALF_OPEN:
+            return self._probes < self.half_open_max_calls
+
+        return True
+
+    def _before_call(self) -> None:
+        if self.state is CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                metrics.increment(f"circuit.{self.name}.rejected")
+                raise DependencyUnavailableError(self, "circuit open")
+
+            self._set_state(CircuitState.HALF_OPEN)
+            self._probes = 0
+
+        if self.state is CircuitState.HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                metrics.increment(f"circuit.{self.name}.rejected")
+                raise DependencyUnavailableError(self, "circuit half-open")
+
+            self._probes += 1
+
+    def _on_success(self) -> None:
+        self._failures = 0
+        self._set_state(CircuitState.CLOSED)
+
+    def _on_failure(self) -> None:
+        metrics.increment(f"circuit.{self.name}.failures")
+        self._failures += 1
+
+        if (
+            self.state is CircuitState.HALF_OPEN
+            or self._failures >= self.failure_threshold
+        ):
+            self._opened_at = time.monotonic()
+            self._set_state(CircuitState.OPEN)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        self._before_call()
+
+        try:
+            async with asyncio.timeout(self.call_timeout):
+                yield
+        except self.passthrough:
+            # not the dependency's doing, we learnt nothing about it
+            if self.state is CircuitState.HALF_OPEN:
+                self._probes -= 1
+            raise
+        except TimeoutError as exc:
+            metrics.increment(f"circuit.{self.name}.timeouts")
+            self._on_failure()
+            raise DependencyUnavailableError(self, "timed out") from exc
+        except Exception as exc:
+            if not self.is_failure(exc):
+                # the dependency answered, it's just not what we wanted
+                self._on_success()
+                raise
+
+            self._on_failure()
+            raise DependencyUnavailableError(self, type(exc).__name__) from exc
+        except BaseException:
+            # cancelled from outside, we learnt nothing about the dependency
+            if self.state is CircuitState.HALF_OPEN:
+                self._probes -= 1
+            raise
+
+        self._on_success()
@@ -1,9 +1,33 @@
 from __future__ import annotations
 
-import aiosu
+import asyncio
+
+import aiohttp
 from adapters.database import Database
+from adapters.database import InvalidationBus
+from adapters.osu import ClientStorage
 from bot.kohaku_bot import Bot
+from common.circuit_breaker import CircuitBreaker
+from common.loop_monitor import LoopMonitor
+from common.rate_limit import ConcurrencyLimiter
+from common.rate_limit import TokenBucketLimiter
+from common.session_token import RevocationSet
+from common.verified_index import VerifiedIndex
 
+loop_monitor: LoopMonitor
 database: Database
-osu_storage: aiosu.v2.ClientStorage
+invalidation_bus: InvalidationBus
+osu_http: aiohttp.ClientSession
+osu_storage: ClientStorage
+osu_auth_breaker: CircuitBreaker
+osu_api_breaker: CircuitBreaker
+discord_breaker: CircuitBreaker
+auth_ip_limiter: TokenBucketLimiter
+auth_code_limiter: TokenBucketLimiter
+verify_button_limiter: TokenBucketLimiter
+verify_concurrency_limiter: ConcurrencyLimiter
+verified_index: VerifiedIndex
+session_revocations: RevocationSet
+username_sync: asyncio.Task[None]
+retention_sweep: asyncio.Task[None]
 bot: Bot
@@ -5,7 +5,15 @@ from enum import Enum
 
 class ServiceError(str, Enum):
     INTERNAL_SERVER_ERROR = "global.internal_server_error"
+    RATE_LIMITED = "global.rate_limited"
 
     USER_NOT_FOUND = "user.not_found"
     USER_ALREADY_VERIFIED = "user.already_verified"
     USER_NOT_VERIFIED = "user.not_verified"
+    VERIFICATION_CODE_EXPIRED = "user.verification_code_expired"
+
+    GUILD_NOT_CONFIGURED = "guild.not_configured"
+
+    OSU_AUTH_UNAVAILABLE = "osu.auth_unavailable"
+    OSU_API_UNAVAILABLE = "osu.api_unavailable"
+    DISCORD_UNAVAILABLE = "discord.unavailable"
@@ -4,26 +4,63 @@ import asyncio
 import base64
 import ssl
 
-import aiosu
+import aiohttp
 import discord
 from adapters import database
+from adapters import osu
+from aiosu.exceptions import APIException
 from common import clients
 from common import logger
 from common import settings
+from common.circuit_breaker import CircuitBreaker
+from common.errors import ServiceError
+from common.loop_monitor import LoopMonitor
+from common.rate_limit import ConcurrencyLimiter
+from common.rate_limit import TokenBucketLimiter
+from common.session_token import RevocationSet
+from common.verified_index import VerifiedIndex
+from repositories import guilds
 from repositories import token
+from repositories import user_tokens
+from repositories import users
+from services import users as users_service
+
+
+async def _start_loop_monitor() -> None:
+    if not settings.LOOP_MONITOR_INTERVAL:
+        return
+
+    clients.loop_monitor = LoopMonitor(
+        interval=settings.LOOP_MONITOR_INTERVAL,
+        threshold=settings.LOOP_BLOCKED_THRESHOLD,
+    )
+    clients.loop_monitor.start()
+    logger.info("Started event loop monitor")
+
+
+async def _stop_loop_monitor() -> None:
+    if not settings.LOOP_MONITOR_INTERVAL:
+        return
+
+    await clients.loop_monitor.stop()
+    del clients.loop_monitor
+    logger.info("Stopped event loop monitor")
 
 
 async def _start_database() -> None:
     logger.info("Connecting to database...")
     clients.database = database.Database(
-        read_dsn=database.dsn(
-            scheme=settings.READ_DB_SCHEME,
-            user=settings.READ_DB_USER,
-            password=settings.READ_DB_PASS,
-            host=settings.READ_DB_HOST,
-            port=settings.READ_DB_PORT,
-            database=settings.READ_DB_NAME,
-        ),
+        read_dsns=[
+            database.dsn(
+                scheme=settings.READ_DB_SCHEME,
+                user=settings.READ_DB_USER,
+                password=settings.READ_DB_PASS,
+                host=host,
+                port=port,
+                database=settings.READ_DB_NAME,
+            )
+            for host, port in settings.READ_DB_HOSTS
+        ],
         read_db_ssl=(
             ssl.create_default_context(
                 purpose=ssl.Purpose.SERVER_AUTH,
@@ -50,6 +87,14 @@ async def _start_database() -> None:
         ),
         min_pool_size=settings.READ_DB_MIN_POOL_SIZE,
         max_pool_size=settings.READ_DB_MAX_POOL_SIZE,
+        statement_timeout=settings.DB_STATEMENT_TIMEOUT,
+        default_timeout=settings.DB_QUERY_TIMEOUT,
+        query_timeouts=settings.DB_QUERY_TIMEOUTS,
+        slow_query_threshold=settings.DB_SLOW_QUERY_THRESHOLD,
+        explain_sample_rate=settings.DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+        explain_interval=settings.DB_SLOW_QUERY_EXPLAIN_INTERVAL,
+        eject_after=settings.DB_REPLICA_EJECT_AFTER,
+        probe_interval=settings.DB_REPLICA_PROBE_INTERVAL,
     )
     await clients.database.connect()
     logger.info("Connected to database(s)")
@@ -62,16 +107,280 @@ async def _shutdown_database() -> None:
     logger.info("Closed database connection")
 
 
+async def _start_invalidation_bus() -> None:
+    logger.info("Starting cache invalidation bus...")
+    # NOTIFY is sent through the write pool, and isn't replicated
+    clients.invalidation_bus = database.InvalidationBus(
+        database=clients.database,
+        listen_dsn=database.dsn(
+            scheme=settings.WRITE_DB_SCHEME,
+            user=settings.WRITE_DB_USER,
+            password=settings.WRITE_DB_PASS,
+            host=settings.WRITE_DB_HOST,
+            port=settings.WRITE_DB_PORT,
+            database=settings.WRITE_DB_NAME,
+        ),
+        listen_db_ssl=(
+            ssl.create_default_context(
+                purpose=ssl.Purpose.SERVER_AUTH,
+                cadata=base64.b64decode(settings.WRITE_DB_CA_CERT_BASE64).decode(),
+            )
+            if settings.WRITE_DB_USE_SSL
+            else False
+        ),
+        channel=settings.INVALIDATION_CHANNEL,
+        reconnect_delay=settings.INVALIDATION_RECONNECT_DELAY,
+        keepalive_interval=settings.INVALIDATION_KEEPALIVE_INTERVAL,
+    )
+    await clients.invalidation_bus.start()
+    logger.info("Started cache invalidation bus")
+
+
+async def _shutdown_invalidation_bus() -> None:
+    logger.info("Stopping cache invalidation bus...")
+    await clients.invalidation_bus.stop()
+    del clients.invalidation_bus
+    logger.info("Stopped cache invalidation bus")
+
+
+async def _start_osu_http() -> None:
+    logger.info("Starting osu! HTTP session...")
+    clients.osu_http = osu.create_http_session(
+        max_connections=settings.OSU_HTTP_MAX_CONNECTIONS,
+        max_connections_per_host=settings.OSU_HTTP_MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout=settings.OSU_HTTP_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl=settings.OSU_HTTP_DNS_CACHE_TTL,
+    )
+    logger.info("Started osu! HTTP session")
+
+
+async def _shutdown_osu_http() -> None:
+    logger.info("Closing osu! HTTP session...")
+    await clients.osu_http.close()
+    del clients.osu_http
+    logger.info("Closed osu! HTTP session")
+
+
+def _is_osu_failure(exc: BaseException) -> bool:
+    if isinstance(exc, APIException):
+        return exc.status >= 500 or exc.status == 429
+
+    return isinstance(exc, aiohttp.ClientError)
+
+
+def _is_discord_failure(exc: BaseException) -> bool:
+    if isinstance(exc, discord.HTTPException):
+        return exc.status >= 500 or exc.status == 429
+
+    return isinstance(exc, (aiohttp.ClientError, discord.RateLimited))
+
+
+async def _start_circuit_breakers() -> None:
+    clients.osu_auth_breaker = CircuitBreaker(
+        name="osu_auth",
+        service_error=ServiceError.OSU_AUTH_UNAVAILABLE,
+        is_failure=_is_osu_failure,
+        call_timeout=settings.OSU_AUTH_TIMEOUT,
+        failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+        passthrough=database.DATABASE_ERRORS,
+    )
+    clients.osu_api_breaker = CircuitBreaker(
+        name="osu_api",
+        service_error=ServiceError.OSU_API_UNAVAILABLE,
+        is_failure=_is_osu_failure,
+        call_timeout=settings.OSU_API_TIMEOUT,
+        failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+        passthrough=database.DATABASE_ERRORS,
+    )
+    clients.discord_breaker = CircuitBreaker(
+        name="discord_rest",
+        service_error=ServiceError.DISCORD_UNAVAILABLE,
+        is_failure=_is_discord_failure,
+        call_timeout=settings.DISCORD_REST_TIMEOUT,
+        failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+        passthrough=database.DATABASE_ERRORS,
+    )
+
+
+async def _start_rate_limiters() -> None:
+    clients.auth_ip_limiter = TokenBucketLimiter(
+        name="auth_ip",
+        capacity=settings.AUTH_IP_RATE_LIMIT,
+        period=settings.AUTH_IP_RATE_PERIOD,
+        max_keys=settings.RATE_LIMIT_MAX_KEYS,
+    )
+    clients.auth_code_limiter = TokenBucketLimiter(
+        name="auth_code",
+        capacity=settings.AUTH_CODE_RATE_LIMIT,
+        period=settings.AUTH_CODE_RATE_PERIOD,
+        max_keys=settings.RATE_LIMIT_MAX_KEYS,
+    )
+    clients.verify_button_limiter = TokenBucketLimiter(
+        name="verify_button",
+        capacity=settings.VERIFY_BUTTON_RATE_LIMIT,
+        period=settings.VERIFY_BUTTON_RATE_PERIOD,
+        max_keys=settings.RATE_LIMIT_MAX_KEYS,
+    )
+    clients.verify_concurrency_limiter = ConcurrencyLimiter(
+        name="verify",
+        limit=settings.VERIFY_MAX_IN_FLIGHT,
+    )
+
+
 async def _start_osu_storage() -> None:
     logger.info("Starting osu! token storage...")
-    clients.osu_storage = aiosu.v2.ClientStorage(
+    clients.osu_storage = osu.ClientStorage(
+        http=clients.osu_http,
+        max_clients=settings.OSU_CLIENT_CACHE_MAX_SIZE,
+        idle_ttl=settings.OSU_CLIENT_CACHE_IDLE_TTL,
         token_repository=token.TokenRepository(),
         client_id=settings.OSU_CLIENT_ID,
         client_secret=settings.OSU_CLIENT_SECRET,
+        base_url=settings.OSU_BASE_URL,
+        app_limiter=(settings.OSU_APP_CLIENT_RATE_LIMIT, 60),
+    )
+    clients.invalidation_bus.subscribe(
+        user_tokens.CACHE_TOPIC,
+        _invalidate_osu_clients,
     )
     logger.info("Started osu! token storage")
 
 
+async def _invalidate_osu_clients(keys: list[str] | None) -> None:
+    await clients.osu_storage.forget_clients(
+        (
+            [
+                int(key.removeprefix("user_id:"))
+                for key in keys
+                if key.startswith("user_id:")
+            ]
+            if keys is not None
+            else None
+        ),
+    )
+
+
+async def _start_verified_index() -> None:
+    logger.info("Loading verified members index...")
+    clients.verified_index = VerifiedIndex()
+    # subscribed first, so changes made while loading aren't missed
+    clients.invalidation_bus.subscribe(
+        users.CACHE_TOPIC,
+        users_service.refresh_verified_index,
+    )
+    await users_service.load_verified_index()
+    logger.info(
+        "Loaded verified members index",
+        members=len(clients.verified_index),
+        bytes=clients.verified_index.nbytes,
+    )
+
+
+async def _start_session_revocations() -> None:
+    clients.session_revocations = RevocationSet(settings.SESSION_TOKEN_MAX_AGE)
+    if settings.SESSION_MODE != "stateless":
+        return
+
+    logger.info("Loading revoked sessions...")
+    # subscribed first, so revocations made while loading aren't missed
+    clients.invalidation_bus.subscribe(
+        users_service.SESSIONS_TOPIC,
+        users_service.refresh_session_revocations,
+    )
+    await users_service.load_session_revocations()
+    logger.info(
+        "Loaded revoked sessions",
+        sessions=len(clients.session_revocations),
+    )
+
+
+async def _run_username_sync() -> None:
+    while True:
+        try:
+            await asyncio.sleep(await users_service.time_until_username_sync())
+            await users_service.sync_osu_usernames()
+        except Exception as exc:
+            # e.g. the database is down, the next pass may well succeed
+            logger.error("osu! username sync failed", exc_info=exc)
+        # don't retry right away after a pass that failed or was skipped
+        await asyncio.sleep(settings.USERNAME_SYNC_RETRY_DELAY)
+
+
+async def _start_username_sync() -> None:
+    if not settings.USERNAME_SYNC_INTERVAL:
+        return
+
+    clients.username_sync = asyncio.create_task(_run_username_sync())
+    logger.info("Scheduled osu! username sync")
+
+
+async def _stop_username_sync() -> None:
+    if not settings.USERNAME_SYNC_INTERVAL:
+        return
+
+    clients.username_sync.cancel()
+    try:
+        await clients.username_sync
+    except asyncio.CancelledError:
+        pass
+    del clients.username_sync
+    logger.info("Stopped osu! username sync")
+
+
+async def _run_retention_sweep() -> None:
+    while True:
+        await asyncio.sleep(settings.RETENTION_SWEEP_INTERVAL)
+        try:
+            await users_service.sweep_unverified()
+        except Exception as exc:
+            # e.g. the database is down, the next sweep may well succeed
+            logger.error("Retention sweep failed", exc_info=exc)
+
+
+async def _start_retention_sweep() -> None:
+    if not settings.RETENTION_SWEEP_INTERVAL:
+        return
+
+    clients.retention_sweep = asyncio.create_task(_run_retention_sweep())
+    logger.info("Scheduled retention sweep")
+
+
+async def _stop_retention_sweep() -> None:
+    if not settings.RETENTION_SWEEP_INTERVAL:
+        return
+
+    clients.retention_sweep.cancel()
+    try:
+        await clients.retention_sweep
+    except asyncio.CancelledError:
+        pass
+    del clients.retention_sweep
+    logger.info("Stopped retention sweep")
+
+
+async def _register_default_guild() -> None:
+    if settings.DISCORD_GUILD_ID is None:
+        return
+
+    if (
+        settings.DISCORD_VERIFY_CHANNEL_ID is None
+        or settings.DISCORD_VERIFIED_ROLE_ID is None
+    ):
+        raise RuntimeError(
+            "DISCORD_GUILD_ID needs DISCORD_VERIFY_CHANNEL_ID and DISCORD_VERIFIED_ROLE_ID",
+        )
+
+    await guilds.upsert(
+        guild_id=settings.DISCORD_GUILD_ID,
+        verify_channel_id=settings.DISCORD_VERIFY_CHANNEL_ID,
+        verified_role_id=settings.DISCORD_VERIFIED_ROLE_ID,
+    )
+    logger.info("Registered the default guild", guild_id=settings.DISCORD_GUILD_ID)
+
+
 async def _start_discord_bot() -> None:
     logger.info("Starting discord bot...")
 
@@ -85,8 +394,8 @@ async def _start_discord_bot() -> None:
 
     clients.bot = bot.Bot(
         intents=intents,
-        verify_channel_id=settings.DISCORD_VERIFY_CHANNEL_ID,
-        guild_id=settings.DISCORD_GUILD_ID,
+        shard_count=settings.DISCORD_SHARD_COUNT,
+        shard_ids=settings.DISCORD_SHARD_IDS,
     )
 
     loop = asyncio.get_event_loop()
@@ -97,6 +406,7 @@ async def _start_discord_bot() -> None:
 
 async def _stop_discord_bot() -> None:
     logger.info("Stopping discord bot...")
+    # also writes the leaves and username changes the bot still buffers
     await clients.bot.close()
     del clients.bot
     logger.info("Stopped discord bot")
@@ -110,12 +420,29 @@ async def _shutdown_osu_storage() -> None:
 
 
 async def start() -> None:
+    # first, startup blocks the loop too
+    await _start_loop_monitor()
     await _start_database()
+    await _start_invalidation_bus()
+    await _start_circuit_breakers()
+    await _start_rate_limiters()
+    await _start_osu_http()
     await _start_osu_storage()
+    await _start_verified_index()
+    await _start_session_revocations()
+    await _start_username_sync()
+    await _start_retention_sweep()
+    await _register_default_guild()
     await _start_discord_bot()
 
 
 async def shutdown() -> None:
-    await _shutdown_database()
-    await _shutdown_osu_storage()
+    # the bot goes first, it may still have work to flush to the database
     await _stop_discord_bot()
+    await _stop_retention_sweep()
+    await _stop_username_sync()
+    await _shutdown_osu_storage()
+    await _shutdown_osu_http()
+    await _shutdown_invalidation_bus()
+    await _shutdown_database()
+    await _stop_loop_monitor()
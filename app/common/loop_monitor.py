@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from common import logger
+from common import metrics
+
+# frames of the blocking stack that get logged, innermost last
+_STACK_LIMIT = 30
+
+
+class LoopMonitor:
+    """Measure event loop lag, and log what blocks the loop.
+
+    The API, the discord bot and the osu! clients share one loop, so any
+    callback that doesn't yield stalls all of them. A task sleeps `interval`
+    seconds in a loop, and how late it wakes up is the loop's lag, observed
+    as `event_loop.lag`. Meanwhile a watchdog thread checks on that task:
+    once it's more than `threshold` seconds overdue, the loop is stuck in a
+    callback, and the loop thread's stack is logged while it still is.
+
+    Unlike asyncio's debug mode this costs a few wake-ups per second, not a
+    timing of every callback. Code holding the GIL in a C extension keeps
+    the watchdog from running too, so it's only reported if it's still
+    blocking once it lets go.
+    """
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        self.interval = interval
+        self.threshold = threshold
+
+        self._loop_thread_id = 0
+        self._heartbeat = 0.0
+        self._task: asyncio.Task[None] | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+
+        self._task = asyncio.create_task(self._tick_forever())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            name="loop-monitor",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._watchdog is not None:
+            # wakes up right away, the event is set
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _tick_forever(self) -> None:
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+            lag = max(0.0, time.monotonic() - self._heartbeat - self.interval)
+            metrics.observe("event_loop.lag", lag)
+            if lag > self.threshold:
+                metrics.increment("event_loop.blocked")
+
+    def _watch(self) -> None:
+        # one stack per stall, not one per check while it lasts
+        reported_heartbeat = 0.0
+
+        while not self._stopping.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            overdue = time.monotonic() - heartbeat - self.interval
+            if overdue <= self.threshold or heartbeat == reported_heartbeat:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            reported_heartbeat = heartbeat
+            logger.warning(
+                "Event loop is blocked",
+                blocked_for=round(overdue, 3),
+                blocking_stack="".join(
+                    traceback.format_stack(frame, limit=_STACK_LIMIT),
+                ),
+            )
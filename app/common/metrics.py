@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# how many recent samples each histogram keeps to estimate its percentiles
+_RESERVOIR_SIZE = 1024
+
+_counters: dict[str, int] = {}
+_gauges: dict[str, float] = {}
+_histograms: dict[str, _Histogram] = {}
+
+
+class _Histogram:
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque[float] = deque(maxlen=_RESERVOIR_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self) -> dict[str, float]:
+        samples = sorted(self.samples)
+
+        def percentile(pct: float) -> float:
+            if not samples:
+                return 0.0
+
+            return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
+
+
+def increment(name: str, value: int = 1) -> None:
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name: str, value: float) -> None:
+    _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    if (histogram := _histograms.get(name)) is None:
+        histogram = _histograms[name] = _Histogram()
+
+    histogram.observe(value)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at)
+
+
+def snapshot() -> dict[str, Any]:
+    return {
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "histograms": {name: h.summary() for name, h in _histograms.items()},
+    }
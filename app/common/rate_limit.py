@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+
+from common import metrics
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key (client IP, discord id, ...).
+
+    Each key may spend `capacity` requests at once, refilled at
+    `capacity / period` per second. Only the `max_keys` most recently seen
+    keys are tracked; a forgotten key starts over with a full bucket.
+    """
+
+    def __init__(self, name: str, capacity: int, period: float, max_keys: int) -> None:
+        self.name = name
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._refill_rate = capacity / period
+        # key -> (tokens left, last refill), in least recently used order
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def allow(self, key: str) -> bool:
+        now = time.monotonic()
+        tokens, refilled_at = self._buckets.pop(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - refilled_at) * self._refill_rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            del self._buckets[next(iter(self._buckets))]
+
+        if not allowed:
+            metrics.increment(f"rate_limit.{self.name}.rejected")
+
+        return allowed
+
+
+class ConcurrencyLimiter:
+    """Caps how many calls may be in flight, rejecting instead of queueing."""
+
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit:
+            metrics.increment(f"concurrency.{self.name}.rejected")
+            return False
+
+        self.in_flight += 1
+        metrics.gauge(f"concurrency.{self.name}.in_flight", self.in_flight)
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        metrics.gauge(f"concurrency.{self.name}.in_flight", self.in_flight)
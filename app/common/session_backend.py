@@ -2,53 +2,54 @@
 
 from __future__ import annotations
 
-from typing import Generic
-from typing import cast
 from uuid import UUID
 
-from api.osu.models import User as UserModel
+from common import clients
 from common.errors import ServiceError
-from fastapi_sessions.backends.session_backend import BackendError
+from fastapi import HTTPException
 from fastapi_sessions.backends.session_backend import SessionBackend
-from fastapi_sessions.backends.session_backend import SessionModel
-from fastapi_sessions.frontends.session_frontend import ID
 from repositories.users import User
 from services import users
 
 
-class DatabaseBackend(SessionBackend[UUID, UserModel]):  # type: ignore
-    """Stores session data in a dictionary."""
+class DatabaseBackend(SessionBackend[UUID, User]):  # type: ignore
+    """Stores session ids on the users they belong to.
 
-    async def create(self, session_id: UUID, data: UserModel) -> None:
+    Sessions are the user rows themselves, as the repository returns them.
+    """
+
+    async def create(self, session_id: UUID, data: User) -> None:
         """Create a new session entry."""
-        _data = cast(User, dict(data))
-        user = await users.fetch_by_user_id(_data["user_id"])
+        # on the write connection, the user may have just been created
+        async with clients.database.unit_of_work(name="sessions.create"):
+            user = await users.fetch_by_user_id(data["user_id"])
 
-        # we update it beceause we already created the user
-        if not isinstance(user, ServiceError):
-            await users.partial_update(
-                user_id=_data["user_id"],
-                session_id=session_id,
-            )
+            # we update it beceause we already created the user
+            if not isinstance(user, ServiceError):
+                await users.partial_update(
+                    user_id=data["user_id"],
+                    session_id=session_id,
+                )
 
-    async def read(self, session_id: UUID) -> None | UserModel:
+    async def read(self, session_id: UUID) -> None | User:
         """Read an existing session data."""
         user = await users.fetch_by_session_id(session_id)
 
+        if user is ServiceError.USER_NOT_FOUND:
+            return None
+
         if isinstance(user, ServiceError):
-            if user is ServiceError.USER_NOT_FOUND:
-                return None
+            raise HTTPException(status_code=500, detail="Failed to read session")
 
-        return UserModel.model_validate(user)
+        return user
 
-    async def update(self, session_id: UUID, data: UserModel) -> None:
+    async def update(self, session_id: UUID, data: User) -> None:
         """Update an existing session."""
-        _data = cast(User, dict(data))
         user = await users.fetch_by_session_id(session_id)
 
         if not isinstance(user, ServiceError):
             await users.partial_update(
-                user_id=_data["user_id"],
+                user_id=data["user_id"],
                 session_id=session_id,
             )
 
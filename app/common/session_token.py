@@ -0,0 +1,118 @@
+"""Signed session tokens, checked without the database."""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Iterable
+from typing import TypedDict
+
+from common import metrics
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import Response
+from fastapi_sessions.frontends.implementations import SessionCookie
+from fastapi_sessions.frontends.session_frontend import FrontendError
+from itsdangerous import BadSignature
+
+
+class SessionClaims(TypedDict):
+    user_id: int
+    discord_id: str
+    issued_at: float
+
+
+def new_claims(user_id: int, discord_id: str) -> SessionClaims:
+    return {"user_id": user_id, "discord_id": discord_id, "issued_at": time.time()}
+
+
+class SessionTokenCookie(SessionCookie):  # type: ignore
+    """Session cookie carrying signed claims instead of a session id.
+
+    The claims expire with the cookie's `max_age`. Revoked sessions are told
+    apart by a `RevocationSet`, not by this cookie.
+    """
+
+    def __call__(self, request: Request) -> SessionClaims | FrontendError:
+        token = request.cookies.get(self.model.name)
+
+        if not token:
+            if self.auto_error:
+                raise HTTPException(status_code=403, detail="No session provided")
+
+            error = FrontendError("No session cookie attached to request")
+            self.attach_id_state(request, error)
+            return error
+
+        try:
+            payload = self.signer.loads(token, max_age=self.cookie_params.max_age)
+            user_id, discord_id, issued_at = payload
+            claims: SessionClaims = {
+                "user_id": int(user_id),
+                "discord_id": str(discord_id),
+                "issued_at": float(issued_at),
+            }
+        except (BadSignature, TypeError, ValueError):
+            # BadSignature covers expired tokens, the rest are cookies signed
+            # with the same key in another session mode
+            if self.auto_error:
+                raise HTTPException(status_code=401, detail="Invalid session provided")
+
+            error = FrontendError("Session cookie is invalid")
+            self.attach_id_state(request, error)
+            return error
+
+        self.attach_id_state(request, claims)
+        return claims
+
+    def attach_to_response(self, response: Response, claims: SessionClaims) -> None:
+        response.set_cookie(
+            key=self.model.name,
+            value=self.signer.dumps(
+                [claims["user_id"], claims["discord_id"], claims["issued_at"]],
+            ),
+            **dict(self.cookie_params),
+        )
+
+
+class RevocationSet:
+    """user_id -> when its sessions were revoked, answered from memory.
+
+    Tokens issued before that are rejected. An entry is only needed until
+    every token it could reject has expired, so entries older than `max_age`
+    are dropped as new ones come in.
+    """
+
+    __slots__ = ("max_age", "_revoked_at")
+
+    def __init__(self, max_age: float) -> None:
+        self.max_age = max_age
+        # in the order revocations were recorded, roughly oldest first
+        self._revoked_at: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._revoked_at)
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        revoked_at = self._revoked_at.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def revoke(self, user_id: int, revoked_at: float) -> None:
+        revoked_at = max(revoked_at, self._revoked_at.pop(user_id, revoked_at))
+        self._revoked_at[user_id] = revoked_at
+        self._prune()
+
+    def revoke_many(self, revocations: Iterable[tuple[int, float]]) -> None:
+        for user_id, revoked_at in sorted(revocations, key=lambda item: item[1]):
+            self.revoke(user_id, revoked_at)
+
+    def _prune(self) -> None:
+        expired_before = time.time() - self.max_age
+
+        while self._revoked_at:
+            user_id = next(iter(self._revoked_at))
+            if self._revoked_at[user_id] >= expired_before:
+                break
+
+            del self._revoked_at[user_id]
+
+        metrics.gauge("sessions.revoked", len(self._revoked_at))
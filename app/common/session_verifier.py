@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+from typing import cast
 from uuid import UUID
 
-from api.osu.models import User as UserModel
+from common import clients
 from common.session_backend import DatabaseBackend
+from common.session_token import SessionClaims
 from fastapi import HTTPException
+from fastapi import Request
+from fastapi_sessions.frontends.session_frontend import FrontendError
 from fastapi_sessions.session_verifier import SessionVerifier
+from repositories.users import User
 
 
-class BasicVerifier(SessionVerifier[UUID, UserModel]):  # type: ignore
+class BasicVerifier(SessionVerifier[UUID, User]):  # type: ignore
     def __init__(
         self,
         *,
@@ -38,6 +43,44 @@ class BasicVerifier(SessionVerifier[UUID, UserModel]):  # type: ignore
     def auth_http_exception(self) -> HTTPException:
         return self._auth_http_exception
 
-    def verify_session(self, model: UserModel) -> bool:
+    def verify_session(self, model: User) -> bool:
         """If the session exists, it is valid"""
         return True
+
+
+class StatelessVerifier:
+    """Verifies the claims of a `SessionTokenCookie` without any database access."""
+
+    def __init__(
+        self,
+        *,
+        identifier: str,
+        auth_http_exception: HTTPException,
+    ):
+        self._identifier = identifier
+        self._auth_http_exception = auth_http_exception
+
+    @property
+    def identifier(self) -> str:
+        return self._identifier
+
+    @property
+    def auth_http_exception(self) -> HTTPException:
+        return self._auth_http_exception
+
+    async def __call__(self, request: Request) -> SessionClaims:
+        try:
+            claims = request.state.session_ids[self.identifier]
+        except Exception:
+            raise HTTPException(
+                status_code=500,
+                detail="internal failure of session verification",
+            )
+
+        if isinstance(claims, FrontendError) or clients.session_revocations.is_revoked(
+            claims["user_id"],
+            claims["issued_at"],
+        ):
+            raise self.auth_http_exception
+
+        return cast(SessionClaims, claims)
@@ -16,6 +16,8 @@ APP_ENV = os.environ["APP_ENV"]
 APP_HOST = os.environ["APP_HOST"]
 APP_PORT = os.environ["APP_PORT"]
 APP_LOG_LEVEL = os.environ["APP_LOG_LEVEL"]
+# seconds a request may spend on database queries, 0 disables
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", "15"))
 
 # frontend
 FRONTEND_HOST = os.environ["FRONTEND_HOST"]
@@ -40,6 +42,22 @@ READ_DB_CA_CERT_BASE64 = os.environ["READ_DB_CA_CERT_BASE64"]
 READ_DB_MIN_POOL_SIZE = int(os.environ["READ_DB_MIN_POOL_SIZE"])
 READ_DB_MAX_POOL_SIZE = int(os.environ["READ_DB_MAX_POOL_SIZE"])
 READ_DB_USE_SSL = read_bool(os.environ["READ_DB_USE_SSL"])
+# read replicas as host:port,... sharing the settings above, reads are
+# balanced across them
+READ_DB_HOSTS = [
+    (host, int(port))
+    for host, _, port in (
+        entry.strip().rpartition(":")
+        for entry in (
+            os.environ.get("READ_DB_HOSTS") or f"{READ_DB_HOST}:{READ_DB_PORT}"
+        ).split(",")
+        if entry.strip()
+    )
+]
+# a replica is ejected after this many connection errors in a row, and
+# probed every PROBE_INTERVAL seconds until it's back
+DB_REPLICA_EJECT_AFTER = int(os.environ.get("DB_REPLICA_EJECT_AFTER", "3"))
+DB_REPLICA_PROBE_INTERVAL = float(os.environ.get("DB_REPLICA_PROBE_INTERVAL", "5"))
 
 WRITE_DB_SCHEME = os.environ["WRITE_DB_SCHEME"]
 WRITE_DB_HOST = os.environ["WRITE_DB_HOST"]
@@ -52,18 +70,136 @@ WRITE_DB_MIN_POOL_SIZE = int(os.environ["WRITE_DB_MIN_POOL_SIZE"])
 WRITE_DB_MAX_POOL_SIZE = int(os.environ["WRITE_DB_MAX_POOL_SIZE"])
 WRITE_DB_USE_SSL = read_bool(os.environ["WRITE_DB_USE_SSL"])
 
+# seconds, 0 disables. The server cancels statements past STATEMENT_TIMEOUT,
+# callers stop waiting after QUERY_TIMEOUT or their query's own timeout.
+DB_STATEMENT_TIMEOUT = float(os.environ.get("DB_STATEMENT_TIMEOUT", "30"))
+DB_QUERY_TIMEOUT = float(os.environ.get("DB_QUERY_TIMEOUT", "5"))
+DB_QUERY_TIMEOUTS = {
+    name: float(timeout)
+    for name, timeout in (
+        entry.split("=")
+        for entry in os.environ.get("DB_QUERY_TIMEOUTS", "").split(",")
+        if entry
+    )
+}
+# seconds from which a statement is logged as slow, 0 disables
+DB_SLOW_QUERY_THRESHOLD = float(os.environ.get("DB_SLOW_QUERY_THRESHOLD", "0.5"))
+DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(
+    os.environ.get("DB_SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"),
+)
+DB_SLOW_QUERY_EXPLAIN_INTERVAL = float(
+    os.environ.get("DB_SLOW_QUERY_EXPLAIN_INTERVAL", "300"),
+)
+
 # discord
 DISCORD_BOT_TOKEN = os.environ["DISCORD_BOT_TOKEN"]
-DISCORD_GUILD_ID = int(os.environ["DISCORD_GUILD_ID"])
-DISCORD_VERIFY_CHANNEL_ID = int(os.environ["DISCORD_VERIFY_CHANNEL_ID"])
-DISCORD_VERIFIED_ROLE_ID = int(os.environ["DISCORD_VERIFIED_ROLE_ID"])
+# guilds are configured in the guilds table, this one is added to it on startup
+DISCORD_GUILD_ID = os.environ.get("DISCORD_GUILD_ID") or None
+DISCORD_VERIFY_CHANNEL_ID = os.environ.get("DISCORD_VERIFY_CHANNEL_ID") or None
+DISCORD_VERIFIED_ROLE_ID = os.environ.get("DISCORD_VERIFIED_ROLE_ID") or None
+# unset lets discord pick the shard count and runs every shard in this process
+DISCORD_SHARD_COUNT = (
+    int(os.environ["DISCORD_SHARD_COUNT"])
+    if os.environ.get("DISCORD_SHARD_COUNT")
+    else None
+)
+DISCORD_SHARD_IDS = (
+    [int(shard_id) for shard_id in os.environ["DISCORD_SHARD_IDS"].split(",")]
+    if os.environ.get("DISCORD_SHARD_IDS")
+    else None
+)
+DISCORD_REST_TIMEOUT = float(os.environ.get("DISCORD_REST_TIMEOUT", "10"))
+VERIFY_BUTTON_LATENCY_BUDGET = float(
+    os.environ.get("VERIFY_BUTTON_LATENCY_BUDGET", "10"),
+)
+DISCORD_USERNAME_FLUSH_INTERVAL = float(
+    os.environ.get("DISCORD_USERNAME_FLUSH_INTERVAL", "10"),
+)
+DISCORD_USERNAME_BATCH_MAX_SIZE = int(
+    os.environ.get("DISCORD_USERNAME_BATCH_MAX_SIZE", "500"),
+)
+MEMBER_REMOVE_BATCH_WINDOW = float(os.environ.get("MEMBER_REMOVE_BATCH_WINDOW", "2"))
+MEMBER_REMOVE_BATCH_MAX_SIZE = int(
+    os.environ.get("MEMBER_REMOVE_BATCH_MAX_SIZE", "500"),
+)
+MEMBER_REMOVE_REVOKE_CONCURRENCY = int(
+    os.environ.get("MEMBER_REMOVE_REVOKE_CONCURRENCY", "8"),
+)
 
 # osu
 OSU_CLIENT_ID = int(os.environ["OSU_CLIENT_ID"])
 OSU_CLIENT_SECRET = os.environ["OSU_CLIENT_SECRET"]
 OSU_REDIRECT_URI = os.environ["OSU_REDIRECT_URI"]
+OSU_BASE_URL = os.environ.get("OSU_BASE_URL", "https://osu.ppy.sh")
+OSU_HTTP_MAX_CONNECTIONS = int(os.environ.get("OSU_HTTP_MAX_CONNECTIONS", "100"))
+OSU_HTTP_MAX_CONNECTIONS_PER_HOST = int(
+    os.environ.get("OSU_HTTP_MAX_CONNECTIONS_PER_HOST", "50"),
+)
+OSU_HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("OSU_HTTP_KEEPALIVE_TIMEOUT", "60"))
+OSU_HTTP_DNS_CACHE_TTL = int(os.environ.get("OSU_HTTP_DNS_CACHE_TTL", "300"))
+OSU_CLIENT_CACHE_MAX_SIZE = int(os.environ.get("OSU_CLIENT_CACHE_MAX_SIZE", "1000"))
+OSU_CLIENT_CACHE_IDLE_TTL = float(os.environ.get("OSU_CLIENT_CACHE_IDLE_TTL", "900"))
+OSU_AUTH_TIMEOUT = float(os.environ.get("OSU_AUTH_TIMEOUT", "10"))
+OSU_API_TIMEOUT = float(os.environ.get("OSU_API_TIMEOUT", "10"))
+# requests per minute of the client credentials app client
+OSU_APP_CLIENT_RATE_LIMIT = int(os.environ.get("OSU_APP_CLIENT_RATE_LIMIT", "60"))
+# seconds between osu! username sync passes, 0 disables them
+USERNAME_SYNC_INTERVAL = float(os.environ.get("USERNAME_SYNC_INTERVAL", "86400"))
+USERNAME_SYNC_RETRY_DELAY = float(os.environ.get("USERNAME_SYNC_RETRY_DELAY", "300"))
+USERNAME_SYNC_BATCH_SIZE = int(os.environ.get("USERNAME_SYNC_BATCH_SIZE", "50"))
+USERNAME_SYNC_CONCURRENCY = int(os.environ.get("USERNAME_SYNC_CONCURRENCY", "2"))
+
+# retention, in seconds
+VERIFICATION_CODE_TTL = float(os.environ.get("VERIFICATION_CODE_TTL", "3600"))
+UNVERIFIED_USER_RETENTION = float(
+    os.environ.get("UNVERIFIED_USER_RETENTION", "2592000"),
+)
+# seconds between retention sweeps, 0 disables them
+RETENTION_SWEEP_INTERVAL = float(os.environ.get("RETENTION_SWEEP_INTERVAL", "3600"))
+RETENTION_SWEEP_BATCH_SIZE = int(os.environ.get("RETENTION_SWEEP_BATCH_SIZE", "500"))
+RETENTION_SWEEP_BATCH_DELAY = float(
+    os.environ.get("RETENTION_SWEEP_BATCH_DELAY", "1"),
+)
+
+# event loop lag, in seconds; a 0 interval disables the monitor
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.5"))
+LOOP_BLOCKED_THRESHOLD = float(os.environ.get("LOOP_BLOCKED_THRESHOLD", "0.1"))
 
 # session
 SESSION_COOKIE_NAME = os.environ["SESSION_COOKIE_NAME"]
 SESSION_COOKIE_IDENTIFIER = os.environ["SESSION_COOKIE_IDENTIFIER"]
 SESSION_COOKIE_KEY = os.environ["SESSION_COOKIE_KEY"]
+# "database" looks sessions up by id, "stateless" signs them into the cookie
+SESSION_MODE = os.environ.get("SESSION_MODE", "database")
+SESSION_TOKEN_MAX_AGE = int(os.environ.get("SESSION_TOKEN_MAX_AGE", "1209600"))
+
+# cache invalidation between processes, over LISTEN/NOTIFY on the write database
+INVALIDATION_CHANNEL = os.environ.get("INVALIDATION_CHANNEL", "kohaku_invalidation")
+INVALIDATION_RECONNECT_DELAY = float(
+    os.environ.get("INVALIDATION_RECONNECT_DELAY", "5"),
+)
+INVALIDATION_KEEPALIVE_INTERVAL = float(
+    os.environ.get("INVALIDATION_KEEPALIVE_INTERVAL", "30"),
+)
+
+# circuit breakers around osu! and discord
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(
+    os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"),
+)
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"),
+)
+
+# admission control, limits are "<count> per <period> seconds" token buckets
+AUTH_IP_RATE_LIMIT = int(os.environ.get("AUTH_IP_RATE_LIMIT", "10"))
+AUTH_IP_RATE_PERIOD = float(os.environ.get("AUTH_IP_RATE_PERIOD", "60"))
+AUTH_CODE_RATE_LIMIT = int(os.environ.get("AUTH_CODE_RATE_LIMIT", "5"))
+AUTH_CODE_RATE_PERIOD = float(os.environ.get("AUTH_CODE_RATE_PERIOD", "60"))
+VERIFY_BUTTON_RATE_LIMIT = int(os.environ.get("VERIFY_BUTTON_RATE_LIMIT", "3"))
+VERIFY_BUTTON_RATE_PERIOD = float(os.environ.get("VERIFY_BUTTON_RATE_PERIOD", "60"))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+VERIFY_MAX_IN_FLIGHT = int(os.environ.get("VERIFY_MAX_IN_FLIGHT", "50"))
+
+# internal api
+INTERNAL_API_KEY = os.environ.get("INTERNAL_API_KEY", "")
+LOOKUP_MAX_BATCH_SIZE = int(os.environ.get("LOOKUP_MAX_BATCH_SIZE", "1000"))
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import AsyncIterable
+
+from common import metrics
+
+
+class VerifiedIndex:
+    """Verified discord id -> osu! id, answered from memory.
+
+    Both ids are unsigned 64-bit integers, like snowflakes, kept in two
+    parallel arrays sorted by discord id: about 16 bytes per member instead
+    of the few hundred a dict of strings would take. Lookups are a binary
+    search; updates shift the arrays, which is a memmove and cheap at the
+    size of our guilds.
+    """
+
+    __slots__ = ("_discord_ids", "_osu_ids", "_changes_while_loading")
+
+    def __init__(self) -> None:
+        self._discord_ids = array("Q")
+        self._osu_ids = array("Q")
+        # one list per load() in progress, of (discord id, osu! id or None)
+        self._changes_while_loading: list[list[tuple[int, int | None]]] = []
+
+    def __len__(self) -> int:
+        return len(self._discord_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the index, over-allocation included."""
+        return sys.getsizeof(self._discord_ids) + sys.getsizeof(self._osu_ids)
+
+    def get(self, discord_id: int) -> int | None:
+        i = bisect_left(self._discord_ids, discord_id)
+        if i < len(self._discord_ids) and self._discord_ids[i] == discord_id:
+            return self._osu_ids[i]
+
+        return None
+
+    def set(self, discord_id: int, osu_id: int) -> None:
+        for changes in self._changes_while_loading:
+            changes.append((discord_id, osu_id))
+
+        if _set(self._discord_ids, self._osu_ids, discord_id, osu_id):
+            self._report()
+
+    def discard(self, discord_id: int) -> None:
+        for changes in self._changes_while_loading:
+            changes.append((discord_id, None))
+
+        if _discard(self._discord_ids, self._osu_ids, discord_id):
+            self._report()
+
+    async def load(self, members: AsyncIterable[tuple[int, int]]) -> None:
+        """Replace the whole index, ideally from members sorted by discord id.
+
+        The new index is built on the side, lookups keep being answered from
+        the old one until it's ready. Changes made meanwhile go to the old
+        one and are replayed onto the new one before it replaces it, since
+        `members` may have been read before they were made.
+        """
+        discord_ids = array("Q")
+        osu_ids = array("Q")
+        in_order = True
+        changes: list[tuple[int, int | None]] = []
+        self._changes_while_loading.append(changes)
+
+        try:
+            async for discord_id, osu_id in members:
+                if discord_ids and discord_id <= discord_ids[-1]:
+                    in_order = False
+                discord_ids.append(discord_id)
+                osu_ids.append(osu_id)
+        finally:
+            # by identity, another load's list may be equal to ours
+            self._changes_while_loading = [
+                other for other in self._changes_while_loading if other is not changes
+            ]
+
+        if not in_order:
+            pairs = sorted(dict(zip(discord_ids, osu_ids)).items())
+            discord_ids = array("Q", (discord_id for discord_id, _ in pairs))
+            osu_ids = array("Q", (osu_id for _, osu_id in pairs))
+
+        for discord_id, changed_osu_id in changes:
+            if changed_osu_id is not None:
+                _set(discord_ids, osu_ids, discord_id, changed_osu_id)
+            else:
+                _discard(discord_ids, osu_ids, discord_id)
+
+        self._discord_ids = discord_ids
+        self._osu_ids = osu_ids
+        self._report()
+
+    def _report(self) -> None:
+        metrics.gauge("verified_index.members", len(self))
+        metrics.gauge("verified_index.bytes", self.nbytes)
+
+
+def _set(
+    discord_ids: array[int],
+    osu_ids: array[int],
+    discord_id: int,
+    osu_id: int,
+) -> bool:
+    """Whether a member was added, rather than updated."""
+    i = bisect_left(discord_ids, discord_id)
+    if i < len(discord_ids) and discord_ids[i] == discord_id:
+        osu_ids[i] = osu_id
+        return False
+
+    discord_ids.insert(i, discord_id)
+    osu_ids.insert(i, osu_id)
+    return True
+
+
+def _discard(discord_ids: array[int], osu_ids: array[int], discord_id: int) -> bool:
+    """Whether a member was removed."""
+    i = bisect_left(discord_ids, discord_id)
+    if i < len(discord_ids) and discord_ids[i] == discord_id:
+        del discord_ids[i]
+        del osu_ids[i]
+        return True
+
+    return False
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from typing import cast
+
+from common import clients
+
+# when the bot last finished setting itself up after connecting
+LAST_READY_AT = "last_ready_at"
+# last user_id the osu! username sync got through, and when it last finished
+USERNAME_SYNC_CURSOR = "username_sync_cursor"
+USERNAME_SYNC_COMPLETED_AT = "username_sync_completed_at"
+
+
+def verify_message_id_key(guild_id: int) -> str:
+    """Key of the id of the message holding a guild's verification button."""
+    return f"verify_message_id:{guild_id}"
+
+
+async def fetch_value(key: str) -> str | None:
+    value = await clients.database.fetch_val(
+        query="""\
+            SELECT value
+            FROM bot_state
+            WHERE key = :key
+        """,
+        values={
+            "key": key,
+        },
+        name="bot_state.fetch_value",
+    )
+
+    return cast(str | None, value)
+
+
+async def upsert(key: str, value: str) -> None:
+    await clients.database.execute(
+        query="""\
+            INSERT INTO bot_state (key, value, updated_at)
+            VALUES (:key, :value, NOW())
+            ON CONFLICT (key) DO UPDATE
+            SET value = EXCLUDED.value,
+                updated_at = EXCLUDED.updated_at
+        """,
+        values={
+            "key": key,
+            "value": value,
+        },
+        name="bot_state.upsert",
+    )
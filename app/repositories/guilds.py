@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import cast
+from typing import TypedDict
+
+from common import clients
+
+READ_PARAMS = """
+    guild_id,
+    verify_channel_id,
+    verified_role_id,
+    created_at,
+    updated_at
+"""
+
+# invalidation bus topic, see adapters.database.InvalidationBus
+CACHE_TOPIC = "guilds"
+
+
+class Guild(TypedDict):
+    guild_id: str
+    verify_channel_id: str
+    verified_role_id: str
+    created_at: datetime
+    updated_at: datetime
+
+
+async def fetch_all() -> list[Guild]:
+    guilds = await clients.database.fetch_all(
+        query=f"""\
+            SELECT {READ_PARAMS}
+            FROM guilds
+        """,
+        name="guilds.fetch_all",
+    )
+
+    return cast(list[Guild], guilds)
+
+
+async def upsert(
+    guild_id: str,
+    verify_channel_id: str,
+    verified_role_id: str,
+) -> None:
+    await clients.database.execute(
+        query="""\
+            INSERT INTO guilds (guild_id, verify_channel_id, verified_role_id,
+                                created_at, updated_at)
+            VALUES (:guild_id, :verify_channel_id, :verified_role_id, NOW(), NOW())
+            ON CONFLICT (guild_id) DO UPDATE
+            SET verify_channel_id = EXCLUDED.verify_channel_id,
+                verified_role_id = EXCLUDED.verified_role_id,
+                updated_at = EXCLUDED.updated_at
+        """,
+        values={
+            "guild_id": guild_id,
+            "verify_channel_id": verify_channel_id,
+            "verified_role_id": verified_role_id,
+        },
+        name="guilds.upsert",
+    )
+    await clients.invalidation_bus.publish(CACHE_TOPIC, [f"guild_id:{guild_id}"])
@@ -2,12 +2,11 @@ from __future__ import annotations
 
 from aiosu.models import OAuthToken
 from aiosu.v2.repository import BaseTokenRepository
-from common.errors import ServiceError
-from services import users
+from repositories import user_tokens
 
 
 class TokenRepository(BaseTokenRepository):
-    """Repository for osu! tokens."""
+    """Repository for osu! tokens, kept in the user_tokens table."""
 
     async def exists(self, session_id: int) -> bool:
         """Check if token exists in database.
@@ -17,13 +16,7 @@ class TokenRepository(BaseTokenRepository):
         Returns:
             bool: True if token exists, False otherwise.
         """
-        user = await users.fetch_by_user_id(session_id)
-
-        if isinstance(user, ServiceError):
-            if user is ServiceError.USER_NOT_FOUND:
-                return False
-
-        return user["access_token"] is not None  # type: ignore
+        return await user_tokens.fetch(session_id) is not None
 
     async def get(self, session_id: int) -> OAuthToken:
         """Get osu! token from database.
@@ -35,19 +28,16 @@ class TokenRepository(BaseTokenRepository):
         Returns:
             OAuthToken: osu! token.
         """
-        user = await users.fetch_by_user_id(session_id)
-
-        if isinstance(user, ServiceError):
-            raise ValueError("Token not found")
+        tokens = await user_tokens.fetch(session_id)
 
-        if user["access_token"] is None:
+        if tokens is None:
             raise ValueError("Token not found")
 
         return OAuthToken.model_validate(
             {
-                "access_token": user["access_token"],
-                "refresh_token": user["refresh_token"],
-                "expires_on": user["token_expires_on"],
+                "access_token": tokens["access_token"],
+                "refresh_token": tokens["refresh_token"],
+                "expires_on": tokens["expires_on"],
             },
         )
 
@@ -58,14 +48,11 @@ class TokenRepository(BaseTokenRepository):
             session_id (int): User ID.
             token (OAuthToken): osu! token.
         """
-
-        # Update because we already created a user
-        await users.partial_update(
+        await user_tokens.upsert(
             user_id=session_id,
             access_token=token.access_token,
             refresh_token=token.refresh_token,
-            token_expires_on=token.expires_on,
-            osu_id=str(token.owner_id),
+            expires_on=token.expires_on,
         )
         return token
 
@@ -76,29 +63,20 @@ class TokenRepository(BaseTokenRepository):
             session_id (int): Session ID.
             token (OAuthToken): osu! token.
         """
-        await users.partial_update(
+        await user_tokens.upsert(
             user_id=session_id,
             access_token=token.access_token,
             refresh_token=token.refresh_token,
-            token_expires_on=token.expires_on,
-            osu_id=str(token.owner_id),
+            expires_on=token.expires_on,
         )
         return token
 
     async def delete(self, session_id: int) -> None:
         """Delete token data.
 
+        The user stays verified, unverifying is up to the caller.
+
         Args:
             session_id (int): User ID.
         """
-        await users.partial_update(
-            user_id=session_id,
-            verified=False,
-            verification_code=None,
-            access_token=None,
-            refresh_token=None,
-            token_expires_on=None,
-            osu_id=None,
-            osu_username=None,
-            session_id=None,
-        )
+        await user_tokens.delete_many([session_id])
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import cast
+from typing import TypedDict
+
+from common import clients
+
+READ_PARAMS = """
+    user_id,
+    access_token,
+    refresh_token,
+    expires_on,
+    updated_at
+"""
+
+# invalidation bus topic, keys are "user_id:<user_id>"
+CACHE_TOPIC = "user_tokens"
+
+
+class UserTokens(TypedDict):
+    user_id: int
+    access_token: str
+    refresh_token: str | None
+    expires_on: datetime | None
+    updated_at: datetime
+
+
+async def fetch(user_id: int) -> UserTokens | None:
+    """Tokens are read from the write database.
+
+    A refresh replaces the refresh token, reading a replica that hasn't
+    seen the new one yet would refresh with one osu! no longer accepts.
+    """
+    tokens = await clients.database.fetch_one(
+        query=f"""\
+            SELECT {READ_PARAMS}
+            FROM user_tokens
+            WHERE user_id = :user_id
+        """,
+        values={
+            "user_id": user_id,
+        },
+        name="user_tokens.fetch",
+        primary=True,
+    )
+
+    return cast(UserTokens, tokens) if tokens is not None else None
+
+
+async def upsert(
+    user_id: int,
+    access_token: str,
+    refresh_token: str | None,
+    expires_on: datetime | None,
+) -> None:
+    await clients.database.execute(
+        query="""\
+            INSERT INTO user_tokens (user_id, access_token, refresh_token,
+                                     expires_on, updated_at)
+            VALUES (:user_id, :access_token, :refresh_token, :expires_on, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+            SET access_token = EXCLUDED.access_token,
+                refresh_token = EXCLUDED.refresh_token,
+                expires_on = EXCLUDED.expires_on,
+                updated_at = EXCLUDED.updated_at
+        """,
+        values={
+            "user_id": user_id,
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expires_on": expires_on,
+        },
+        name="user_tokens.upsert",
+    )
+    await clients.invalidation_bus.publish(CACHE_TOPIC, [f"user_id:{user_id}"])
+
+
+async def delete_many(user_ids: list[int]) -> None:
+    await clients.database.execute(
+        query="""\
+            DELETE FROM user_tokens
+            WHERE user_id = ANY(:user_ids)
+        """,
+        values={
+            "user_ids": user_ids,
+        },
+        name="user_tokens.delete_many",
+    )
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [f"user_id:{user_id}" for user_id in user_ids],
+    )
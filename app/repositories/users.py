@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import AsyncIterator
 from datetime import datetime
 from typing import cast
 from typing import TypedDict
@@ -13,48 +14,68 @@ READ_PARAMS = """
     user_id,
     discord_id,
     discord_username,
+    guild_id,
     osu_id,
     osu_username,
     verified,
     verification_code,
-    access_token,
-    refresh_token,
-    token_expires_on,
+    verification_code_expires_on,
     session_id,
     created_at,
     updated_at
 """
 
+# invalidation bus topic, see adapters.database.InvalidationBus
+CACHE_TOPIC = "users"
+
 
 class User(TypedDict):
     user_id: int
     discord_id: str
     discord_username: str
+    guild_id: str | None
     osu_id: str | None
     osu_username: str | None
     verified: bool
     verification_code: str | None
-    access_token: str | None
-    refresh_token: str | None
-    token_expires_on: datetime | None
+    verification_code_expires_on: datetime | None
     session_id: UUID | None
     created_at: datetime
     updated_at: datetime
 
 
+class UserWithTokens(User):
+    """A user along with their osu! tokens, as /auth hands them out."""
+
+    access_token: str
+    refresh_token: str | None
+
+
 class UserUpdateFields(TypedDict, total=False):
     discord_id: str
     discord_username: str
+    guild_id: str | None
     osu_id: str | None
     osu_username: str | None
     verified: bool
     verification_code: str | None
-    access_token: str | None
-    refresh_token: str | None
-    token_expires_on: datetime | None
+    verification_code_expires_on: datetime | None
     session_id: UUID | None
 
 
+def cache_keys(user: User) -> list[str]:
+    """Keys other processes may cache this user under.
+
+    Only the current discord_id and session_id are known after a write, so
+    caches must drop every entry of a user when they see its user_id key.
+    """
+    keys = [f"user_id:{user['user_id']}", f"discord_id:{user['discord_id']}"]
+    if user["session_id"] is not None:
+        keys.append(f"session_id:{user['session_id']}")
+
+    return keys
+
+
 async def create(
     discord_id: str,
     discord_username: str,
@@ -62,36 +83,38 @@ async def create(
     osu_username: str | None,
     verified: bool,
     verification_code: str,
-    access_token: str | None = None,
-    refresh_token: str | None = None,
-    token_expires_on: datetime | None = None,
+    verification_code_expires_on: datetime | None = None,
+    guild_id: str | None = None,
     session_id: UUID | None = None,
 ) -> User:
     user = await clients.database.fetch_one(
         query=f"""\
-            INSERT INTO users (discord_id, discord_username, osu_id, osu_username,
-                               verified, verification_code, access_token, refresh_token,
-                               token_expires_on, session_id, created_at, updated_at)
-            VALUES (:discord_id, :discord_username, :osu_id, :osu_username,
-                    :verified, :verification_code,:access_token, :refresh_token,
-                    :token_expires_on, :session_id, NOW(), NOW())
+            INSERT INTO users (discord_id, discord_username, guild_id, osu_id,
+                               osu_username, verified, verification_code,
+                               verification_code_expires_on, session_id, created_at,
+                               updated_at)
+            VALUES (:discord_id, :discord_username, :guild_id, :osu_id,
+                    :osu_username, :verified, :verification_code,
+                    :verification_code_expires_on, :session_id, NOW(), NOW())
             RETURNING {READ_PARAMS}
         """,
         values={
             "discord_id": discord_id,
             "discord_username": discord_username,
+            "guild_id": guild_id,
             "osu_id": osu_id,
             "osu_username": osu_username,
             "verified": verified,
             "verification_code": verification_code,
-            "access_token": access_token,
-            "refresh_token": refresh_token,
-            "token_expires_on": token_expires_on,
+            "verification_code_expires_on": verification_code_expires_on,
             "session_id": session_id,
         },
+        name="users.create",
+        primary=True,
     )
 
     assert user is not None
+    await clients.invalidation_bus.publish(CACHE_TOPIC, cache_keys(cast(User, user)))
     return cast(User, user)
 
 
@@ -112,11 +135,222 @@ async def fetch_many(
         values["limit"] = page
         values["offset"] = (page - 1) * page_size
 
-    users = await clients.database.fetch_all(query, values)
+    users = await clients.database.fetch_all(query, values, name="users.fetch_many")
     return cast(list[User], users)
 
 
-async def fetch_by_user_id(user_id: int) -> User | None:
+async def fetch_many_by_user_ids(
+    user_ids: list[int],
+    primary: bool = False,
+) -> list[User]:
+    users = await clients.database.fetch_all(
+        query=f"""\
+            SELECT {READ_PARAMS}
+            FROM users
+            WHERE user_id = ANY(:user_ids)
+        """,
+        values={
+            "user_ids": user_ids,
+        },
+        name="users.fetch_many_by_user_ids",
+        primary=primary,
+    )
+
+    return cast(list[User], users)
+
+
+async def iterate_verified_osu_ids() -> AsyncIterator[tuple[str, str]]:
+    """Stream (discord_id, osu_id) of every verified user, by discord id.
+
+    Read from the write database: the index it loads must not miss changes
+    already announced on the invalidation bus.
+    """
+    async for row in clients.database.iterate(
+        query="""\
+            SELECT discord_id, osu_id
+            FROM users
+            WHERE verified AND osu_id IS NOT NULL
+            -- numeric order of the ids without casting them
+            ORDER BY LENGTH(discord_id), discord_id
+        """,
+        name="users.iterate_verified_osu_ids",
+        primary=True,
+    ):
+        yield row["discord_id"], row["osu_id"]
+
+
+class VerifiedLink(TypedDict):
+    discord_id: str
+    # None once unverified
+    osu_id: str | None
+    osu_username: str | None
+    verified: bool
+    updated_at: datetime
+
+
+async def iterate_verified_links(
+    updated_since: datetime | None = None,
+) -> AsyncIterator[VerifiedLink]:
+    """Stream the discord <-> osu! links of verified users, never their tokens.
+
+    With `updated_since`, users unverified since then come too, as
+    tombstones with `verified` false, so removed links can be dropped.
+    Users who never finished verifying may show up as tombstones as well,
+    harmlessly: they have no link to drop.
+    """
+    if updated_since is None:
+        query = """\
+            SELECT discord_id, osu_id, osu_username, verified, updated_at
+            FROM users
+            WHERE verified AND osu_id IS NOT NULL
+        """
+        values = {}
+    else:
+        query = """\
+            SELECT discord_id, osu_id, osu_username, verified, updated_at
+            FROM users
+            WHERE updated_at >= :updated_since
+              AND (NOT verified OR osu_id IS NOT NULL)
+        """
+        values = {"updated_since": updated_since}
+
+    async for row in clients.database.iterate(
+        query,
+        values,
+        name="users.iterate_verified_links",
+    ):
+        yield cast(VerifiedLink, row)
+
+
+async def iterate_revoked_sessions(
+    revoked_since: datetime,
+) -> AsyncIterator[tuple[int, datetime]]:
+    """Stream (user_id, revoked_at) of users whose sessions were revoked.
+
+    Read from the write database, like iterate_verified_osu_ids.
+    """
+    async for row in clients.database.iterate(
+        query="""\
+            SELECT user_id, sessions_revoked_at
+            FROM users
+            WHERE sessions_revoked_at >= :revoked_since
+        """,
+        values={
+            "revoked_since": revoked_since,
+        },
+        name="users.iterate_revoked_sessions",
+        primary=True,
+    ):
+        yield row["user_id"], row["sessions_revoked_at"]
+
+
+async def record_sessions_revoked(user_ids: list[int], revoked_at: datetime) -> None:
+    """Record when these users' stateless sessions were revoked.
+
+    Nothing else clears it, verifying again or a new verification code
+    doesn't bring back the sessions issued before. updated_at is left
+    alone, nothing cached reads this column.
+    """
+    await clients.database.execute(
+        query="""\
+            UPDATE users
+            SET sessions_revoked_at = :revoked_at
+            WHERE user_id = ANY(:user_ids)
+        """,
+        values={
+            "user_ids": user_ids,
+            "revoked_at": revoked_at,
+        },
+        name="users.record_sessions_revoked",
+    )
+
+
+class OsuAccount(TypedDict):
+    user_id: int
+    osu_id: str
+    osu_username: str | None
+
+
+async def fetch_verified_osu_accounts(
+    after_user_id: int,
+    limit: int,
+) -> list[OsuAccount]:
+    """A page of verified users' osu! accounts, by user_id."""
+    accounts = await clients.database.fetch_all(
+        query="""\
+            SELECT user_id, osu_id, osu_username
+            FROM users
+            WHERE verified AND osu_id IS NOT NULL AND user_id > :after_user_id
+            ORDER BY user_id
+            LIMIT :limit
+        """,
+        values={
+            "after_user_id": after_user_id,
+            "limit": limit,
+        },
+        name="users.fetch_verified_osu_accounts",
+    )
+
+    return cast(list[OsuAccount], accounts)
+
+
+async def update_osu_usernames(accounts: list[OsuAccount]) -> None:
+    """Write many users' osu! usernames in a single statement.
+
+    A user whose osu! account changed in the meantime is left alone.
+    """
+    await clients.database.execute(
+        query="""\
+            UPDATE users
+            SET osu_username = v.osu_username,
+                updated_at = NOW()
+            FROM UNNEST(
+                CAST(:user_ids AS INTEGER[]),
+                CAST(:osu_ids AS TEXT[]),
+                CAST(:osu_usernames AS TEXT[])
+            ) AS v(user_id, osu_id, osu_username)
+            WHERE users.user_id = v.user_id
+            AND users.osu_id = v.osu_id
+        """,
+        values={
+            "user_ids": [account["user_id"] for account in accounts],
+            "osu_ids": [account["osu_id"] for account in accounts],
+            "osu_usernames": [account["osu_username"] for account in accounts],
+        },
+        name="users.update_osu_usernames",
+    )
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [f"user_id:{account['user_id']}" for account in accounts],
+    )
+
+
+async def update_discord_usernames(discord_usernames: dict[str, str]) -> None:
+    """Write many discord_id -> discord_username changes in a single statement."""
+    rows = []
+    values = {}
+    for i, (discord_id, discord_username) in enumerate(discord_usernames.items()):
+        rows.append(f"(:discord_id_{i}, :discord_username_{i})")
+        values[f"discord_id_{i}"] = discord_id
+        values[f"discord_username_{i}"] = discord_username
+
+    query = f"""\
+        UPDATE users
+        SET discord_username = v.discord_username,
+            updated_at = NOW()
+        FROM (VALUES {", ".join(rows)}) AS v(discord_id, discord_username)
+        WHERE users.discord_id = v.discord_id
+        AND users.discord_username IS DISTINCT FROM v.discord_username
+    """
+
+    await clients.database.execute(query, values, name="users.update_discord_usernames")
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [f"discord_id:{discord_id}" for discord_id in discord_usernames],
+    )
+
+
+async def fetch_by_user_id(user_id: int, primary: bool = False) -> User | None:
     user = await clients.database.fetch_one(
         query=f"""\
             SELECT {READ_PARAMS}
@@ -126,6 +360,8 @@ async def fetch_by_user_id(user_id: int) -> User | None:
         values={
             "user_id": user_id,
         },
+        name="users.fetch_by_user_id",
+        primary=primary,
     )
 
     return cast(User, user) if user is not None else None
@@ -141,11 +377,32 @@ async def fetch_by_discord_id(discord_id: str) -> User | None:
         values={
             "discord_id": discord_id,
         },
+        name="users.fetch_by_discord_id",
     )
 
     return cast(User, user) if user is not None else None
 
 
+async def fetch_many_by_discord_ids(
+    discord_ids: list[str],
+    primary: bool = False,
+) -> list[User]:
+    users = await clients.database.fetch_all(
+        query=f"""\
+            SELECT {READ_PARAMS}
+            FROM users
+            WHERE discord_id = ANY(:discord_ids)
+        """,
+        values={
+            "discord_ids": discord_ids,
+        },
+        name="users.fetch_many_by_discord_ids",
+        primary=primary,
+    )
+
+    return cast(list[User], users)
+
+
 async def fetch_by_discord_username(discord_username: int) -> User | None:
     user = await clients.database.fetch_one(
         query=f"""\
@@ -156,27 +413,40 @@ async def fetch_by_discord_username(discord_username: int) -> User | None:
         values={
             "discord_username": discord_username,
         },
+        name="users.fetch_by_discord_username",
     )
 
     return cast(User, user) if user is not None else None
 
 
-async def fetch_by_verification_code(verification_code: str) -> User | None:
+async def fetch_by_verification_code(
+    verification_code: str,
+    for_update: bool = False,
+) -> User | None:
+    """With `for_update`, the row stays locked until the unit of work ends."""
     user = await clients.database.fetch_one(
         query=f"""\
             SELECT {READ_PARAMS}
             FROM users
             WHERE verification_code = :verification_code
+            {"FOR UPDATE" if for_update else ""}
         """,
         values={
             "verification_code": verification_code,
         },
+        name="users.fetch_by_verification_code",
     )
 
     return cast(User, user) if user is not None else None
 
 
 async def fetch_by_session_id(session_id: UUID) -> User | None:
+    """Sessions are read from the write database.
+
+    /auth writes the session id there, a replica that hasn't seen it yet
+    would reject the very next request; one that hasn't seen a logout would
+    still accept the session.
+    """
     user = await clients.database.fetch_one(
         query=f"""\
             SELECT {READ_PARAMS}
@@ -186,6 +456,8 @@ async def fetch_by_session_id(session_id: UUID) -> User | None:
         values={
             "session_id": session_id,
         },
+        name="users.fetch_by_session_id",
+        primary=True,
     )
 
     return cast(User, user) if user is not None else None
@@ -195,13 +467,12 @@ async def partial_update(
     user_id: int,
     discord_id: str | _UnsetSentinel = UNSET,
     discord_username: str | _UnsetSentinel = UNSET,
+    guild_id: str | None | _UnsetSentinel = UNSET,
     osu_id: str | None | _UnsetSentinel = UNSET,
     osu_username: str | None | _UnsetSentinel = UNSET,
     verified: bool | _UnsetSentinel = UNSET,
     verification_code: str | None | _UnsetSentinel = UNSET,
-    access_token: str | None | _UnsetSentinel = UNSET,
-    refresh_token: str | None | _UnsetSentinel = UNSET,
-    token_expires_on: datetime | None | _UnsetSentinel = UNSET,
+    verification_code_expires_on: datetime | None | _UnsetSentinel = UNSET,
     session_id: UUID | None | _UnsetSentinel = UNSET,
 ) -> User | None:
     update_fields: UserUpdateFields = {}
@@ -209,6 +480,8 @@ async def partial_update(
         update_fields["discord_id"] = discord_id
     if not isinstance(discord_username, _UnsetSentinel):
         update_fields["discord_username"] = discord_username
+    if not isinstance(guild_id, _UnsetSentinel):
+        update_fields["guild_id"] = guild_id
     if not isinstance(osu_id, _UnsetSentinel):
         update_fields["osu_id"] = osu_id
     if not isinstance(osu_username, _UnsetSentinel):
@@ -217,22 +490,140 @@ async def partial_update(
         update_fields["verified"] = verified
     if not isinstance(verification_code, _UnsetSentinel):
         update_fields["verification_code"] = verification_code
-    if not isinstance(access_token, _UnsetSentinel):
-        update_fields["access_token"] = access_token
-    if not isinstance(refresh_token, _UnsetSentinel):
-        update_fields["refresh_token"] = refresh_token
-    if not isinstance(token_expires_on, _UnsetSentinel):
-        update_fields["token_expires_on"] = token_expires_on
+    if not isinstance(verification_code_expires_on, _UnsetSentinel):
+        update_fields["verification_code_expires_on"] = verification_code_expires_on
     if not isinstance(session_id, _UnsetSentinel):
         update_fields["session_id"] = session_id
 
     query = f"""\
         UPDATE users
-        SET {",".join(f"{k} = :{k}" for k in update_fields)}
+        SET {",".join(f"{k} = :{k}" for k in update_fields)},
+            updated_at = NOW()
         WHERE user_id = :user_id
         RETURNING {READ_PARAMS}
     """
     values = {"user_id": user_id} | update_fields
 
-    user = await clients.database.fetch_one(query, values)
-    return cast(User, user) if user is not None else None
+    user = await clients.database.fetch_one(
+        query,
+        values,
+        name="users.partial_update",
+        primary=True,
+    )
+    if user is None:
+        return None
+
+    await clients.invalidation_bus.publish(CACHE_TOPIC, cache_keys(cast(User, user)))
+    return cast(User, user)
+
+
+async def remove_verification_many(user_ids: list[int]) -> None:
+    await clients.database.execute(
+        query="""\
+            UPDATE users
+            SET verified = FALSE,
+                verification_code = NULL,
+                verification_code_expires_on = NULL,
+                osu_id = NULL,
+                osu_username = NULL,
+                session_id = NULL,
+                updated_at = NOW()
+            WHERE user_id = ANY(:user_ids)
+        """,
+        values={
+            "user_ids": user_ids,
+        },
+        name="users.remove_verification_many",
+    )
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [f"user_id:{user_id}" for user_id in user_ids],
+    )
+
+
+async def expire_verification_codes(limit: int) -> list[User]:
+    """Clear up to `limit` expired verification codes of unverified users.
+
+    Codes without one predate expiring codes, they're cleared too. Verified
+    users keep the code they redeemed, it's what tells a concurrent attempt
+    with the same code that it lost. Rows locked by someone else are skipped
+    until the next batch. updated_at is left alone: it's what abandoned
+    users are purged by.
+    """
+    expired = await clients.database.fetch_all(
+        query=f"""\
+            UPDATE users
+            SET verification_code = NULL,
+                verification_code_expires_on = NULL
+            WHERE user_id IN (
+                SELECT user_id
+                FROM users
+                WHERE verification_code IS NOT NULL
+                  AND NOT verified
+                  AND (
+                    verification_code_expires_on IS NULL
+                    OR verification_code_expires_on < NOW()
+                  )
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {READ_PARAMS}
+        """,
+        values={
+            "limit": limit,
+        },
+        name="users.expire_verification_codes",
+        primary=True,
+    )
+
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [key for user in expired for key in cache_keys(cast(User, user))],
+    )
+    return cast(list[User], expired)
+
+
+async def purge_abandoned(
+    untouched_since: datetime,
+    revoked_before: datetime,
+    limit: int,
+) -> list[User]:
+    """Delete up to `limit` users who never linked an osu! account.
+
+    Only those not updated since `untouched_since` go, clicking the verify
+    button again updates them. Users whose verification was removed look
+    the same, those whose sessions were revoked since `revoked_before` are
+    kept: their row is what keeps rejecting the sessions.
+    """
+    purged = await clients.database.fetch_all(
+        query=f"""\
+            DELETE FROM users
+            WHERE user_id IN (
+                SELECT user_id
+                FROM users
+                WHERE NOT verified
+                  AND osu_id IS NULL
+                  AND updated_at < :untouched_since
+                  AND (
+                    sessions_revoked_at IS NULL
+                    OR sessions_revoked_at < :revoked_before
+                  )
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {READ_PARAMS}
+        """,
+        values={
+            "untouched_since": untouched_since,
+            "revoked_before": revoked_before,
+            "limit": limit,
+        },
+        name="users.purge_abandoned",
+        primary=True,
+    )
+
+    await clients.invalidation_bus.publish(
+        CACHE_TOPIC,
+        [key for user in purged for key in cache_keys(cast(User, user))],
+    )
+    return cast(list[User], purged)
@@ -1,17 +1,34 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
 from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from uuid import UUID
 
-from aiosu.utils import auth
+from adapters import osu
 from common import clients
 from common import logger
+from common import metrics
 from common import settings
+from common.circuit_breaker import DependencyUnavailableError
 from common.errors import ServiceError
 from common.typing import _UnsetSentinel
 from common.typing import UNSET
+from repositories import bot_state
+from repositories import user_tokens
 from repositories import users
+from repositories.users import OsuAccount
 from repositories.users import User
+from repositories.users import UserWithTokens
+from repositories.users import VerifiedLink
+
+# invalidation bus topic for revoked stateless sessions, see _revoke_sessions
+SESSIONS_TOPIC = "sessions"
 
 
 async def create(
@@ -19,24 +36,22 @@ async def create(
     discord_username: str,
     verified: bool,
     verification_code: str,
+    verification_code_expires_on: datetime | None = None,
+    guild_id: str | None = None,
     osu_id: str | None = None,
     osu_username: str | None = None,
-    access_token: str | None = None,
-    refresh_token: str | None = None,
-    token_expires_on: datetime | None = None,
     session_id: UUID | None = None,
 ) -> User | ServiceError:
     try:
         user = await users.create(
             discord_id=discord_id,
             discord_username=discord_username,
+            guild_id=guild_id,
             osu_id=osu_id,
             osu_username=osu_username,
             verified=verified,
             verification_code=verification_code,
-            access_token=access_token,
-            refresh_token=refresh_token,
-            token_expires_on=token_expires_on,
+            verification_code_expires_on=verification_code_expires_on,
             session_id=session_id,
         )
     except Exception as exc:  # pragma: no cover
@@ -46,11 +61,62 @@ async def create(
     return user
 
 
+# pg_try_advisory_lock keys, any numbers no other job of ours uses
+USERNAME_SYNC_LOCK_ID = 724_001
+RETENTION_SWEEP_LOCK_ID = 724_002
+
+
+def verification_code_expiry() -> datetime:
+    """When a verification code handed out now stops being redeemable."""
+    return datetime.now(timezone.utc) + timedelta(
+        seconds=settings.VERIFICATION_CODE_TTL,
+    )
+
+
+def _verification_code_expired(user: User) -> bool:
+    # codes handed out before codes expired have no expiry, they're expired
+    expires_on = user["verification_code_expires_on"]
+    return expires_on is None or expires_on <= datetime.now(timezone.utc)
+
+
+def _guild_id_of(user: User) -> int | None:
+    """The guild whose verify button the user clicked.
+
+    Users created before the bot served several guilds have no guild saved,
+    they belong to the guild configured in the environment.
+    """
+    guild_id = user["guild_id"] or settings.DISCORD_GUILD_ID
+    return int(guild_id) if guild_id is not None else None
+
+
 async def verify(
     kohaku_code: str,
     osu_code: str,
     session_id: UUID,
-) -> User | ServiceError:
+) -> UserWithTokens | ServiceError:
+    if not clients.verify_concurrency_limiter.try_acquire():
+        return ServiceError.RATE_LIMITED
+
+    try:
+        return await _verify(kohaku_code, osu_code, session_id)
+    finally:
+        clients.verify_concurrency_limiter.release()
+
+
+async def _verify(
+    kohaku_code: str,
+    osu_code: str,
+    session_id: UUID,
+) -> UserWithTokens | ServiceError:
+    # don't touch the database for a flow that can't finish anyway
+    for breaker in (
+        clients.osu_auth_breaker,
+        clients.osu_api_breaker,
+        clients.discord_breaker,
+    ):
+        if not breaker.available:
+            return breaker.service_error
+
     try:
         user = await users.fetch_by_verification_code(kohaku_code)
 
@@ -60,39 +126,133 @@ async def verify(
         if user["verified"]:
             return ServiceError.USER_ALREADY_VERIFIED
 
-        token = await auth.process_code(
-            client_id=settings.OSU_CLIENT_ID,
-            client_secret=settings.OSU_CLIENT_SECRET,
-            redirect_uri=settings.OSU_REDIRECT_URI,
-            code=osu_code,
-        )
+        if _verification_code_expired(user):
+            return ServiceError.VERIFICATION_CODE_EXPIRED
 
-        client = await clients.osu_storage.get_client(id=user["user_id"], token=token)
-        osu_user = await client.get_me()
+        guild_id = _guild_id_of(user)
+        role_id = clients.bot.verified_role_id(guild_id)
+        if guild_id is None or role_id is None:
+            return ServiceError.GUILD_NOT_CONFIGURED
 
-        await clients.bot.give_role(
-            int(user["discord_id"]),
-            settings.DISCORD_VERIFIED_ROLE_ID,
-        )
+        async with clients.osu_auth_breaker.guard():
+            token = await osu.process_code(
+                http=clients.osu_http,
+                client_id=settings.OSU_CLIENT_ID,
+                client_secret=settings.OSU_CLIENT_SECRET,
+                redirect_uri=settings.OSU_REDIRECT_URI,
+                code=osu_code,
+                base_url=settings.OSU_BASE_URL,
+            )
 
-        user = await users.partial_update(
-            user_id=user["user_id"],
-            osu_id=str(osu_user.id),
-            osu_username=osu_user.username,
-            verified=True,
-            access_token=token.access_token,
-            refresh_token=token.refresh_token,
-            token_expires_on=token.expires_on,
-            session_id=session_id,
-        )
+        client = await clients.osu_storage.get_client(id=user["user_id"], token=token)
+        async with clients.osu_api_breaker.guard():
+            osu_user = await client.get_me()
+
+        async with clients.discord_breaker.guard():
+            await clients.bot.give_role(guild_id, int(user["discord_id"]), role_id)
+
+        async with clients.database.unit_of_work(name="users.verify"):
+            # the same code may have been redeemed while osu! was answering
+            current = await users.fetch_by_verification_code(
+                kohaku_code,
+                for_update=True,
+            )
+            rejected = _redeem_error(current, user["user_id"])
+            if rejected is None:
+                # the client stored them already, unless it was still cached
+                await user_tokens.upsert(
+                    user_id=user["user_id"],
+                    access_token=token.access_token,
+                    refresh_token=token.refresh_token,
+                    expires_on=token.expires_on,
+                )
+                verified_user = await users.partial_update(
+                    user_id=user["user_id"],
+                    osu_id=str(osu_user.id),
+                    osu_username=osu_user.username,
+                    verified=True,
+                    session_id=session_id,
+                )
+
+        if rejected is not None:
+            # a concurrent attempt that won keeps the role and tokens
+            if rejected is not ServiceError.USER_ALREADY_VERIFIED:
+                await _undo_verify(user, guild_id, role_id)
+            return rejected
+    except DependencyUnavailableError as exc:
+        logger.warning("Failed to verify user", reason=str(exc))
+        return exc.service_error
     except Exception as exc:  # pragma: no cover
         logger.error("Failed to verify user", exc_info=exc)
         return ServiceError.INTERNAL_SERVER_ERROR
 
-    if user is None:
+    if verified_user is None:
         return ServiceError.USER_NOT_FOUND
 
-    return user
+    _index_user(verified_user)
+    return UserWithTokens(
+        **verified_user,
+        access_token=token.access_token,
+        refresh_token=token.refresh_token,
+    )
+
+
+def _redeem_error(current: User | None, user_id: int) -> ServiceError | None:
+    """Why the code can't be redeemed for `user_id` anymore, if it can't."""
+    if current is None or current["user_id"] != user_id:
+        return ServiceError.USER_NOT_FOUND
+
+    if current["verified"]:
+        return ServiceError.USER_ALREADY_VERIFIED
+
+    if _verification_code_expired(current):
+        return ServiceError.VERIFICATION_CODE_EXPIRED
+
+    return None
+
+
+async def _undo_verify(user: User, guild_id: int, role_id: int) -> None:
+    """Take back the role and osu! token of a verification rejected last minute.
+
+    Best effort: the user isn't verified either way, a role left behind is
+    only cosmetic and the token expires on its own.
+    """
+    try:
+        async with clients.discord_breaker.guard():
+            await clients.bot.remove_role(guild_id, int(user["discord_id"]), role_id)
+    except Exception as exc:
+        logger.warning("Failed to take back the verified role", exc_info=exc)
+
+    try:
+        client = await clients.osu_storage.take_client(user["user_id"])
+        async with clients.osu_api_breaker.guard():
+            await client.revoke_token_remote()
+        await user_tokens.delete_many([user["user_id"]])
+    except Exception as exc:
+        logger.warning("Failed to revoke the osu! token", exc_info=exc)
+
+
+async def grant_verified_role(user: User, guild_id: int) -> None | ServiceError:
+    """Give an already verified user the verified role of `guild_id`.
+
+    Verification is per account, not per guild: a user verified through
+    another guild gets the role of each guild they click the button in.
+    """
+    role_id = clients.bot.verified_role_id(guild_id)
+    if role_id is None:
+        return None
+
+    try:
+        async with clients.discord_breaker.guard():
+            await clients.bot.give_role(guild_id, int(user["discord_id"]), role_id)
+    except DependencyUnavailableError as exc:
+        logger.warning("Failed to grant verified role", reason=str(exc))
+        return exc.service_error
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to grant verified role", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
+
+    return None
 
 
 async def remove_verification(
@@ -107,19 +267,390 @@ async def remove_verification(
     if not user["verified"]:
         return ServiceError.USER_NOT_VERIFIED
 
-    client = await clients.osu_storage.get_client(id=user["user_id"])
-    await clients.osu_storage.revoke_client(client_uid=user["user_id"])
-    await client.revoke_token()
+    try:
+        # the token is loaded and deleted outside the guard, a database error
+        # says nothing about osu!
+        client = await clients.osu_storage.take_client(user["user_id"])
+        async with clients.osu_api_breaker.guard():
+            await client.revoke_token_remote()
+
+        guild_id = _guild_id_of(user)
+        role_id = clients.bot.verified_role_id(guild_id)
+        if remove_role and guild_id is not None and role_id is not None:
+            async with clients.discord_breaker.guard():
+                await clients.bot.remove_role(
+                    guild_id,
+                    int(user["discord_id"]),
+                    role_id,
+                )
+    except DependencyUnavailableError as exc:
+        logger.warning("Failed to remove verification", reason=str(exc))
+        return exc.service_error
 
-    if remove_role:
-        await clients.bot.remove_role(
-            int(user["discord_id"]),
-            settings.DISCORD_VERIFIED_ROLE_ID,
-        )
+    try:
+        async with clients.database.unit_of_work(name="users.remove_verification"):
+            await users.remove_verification_many([user["user_id"]])
+            await user_tokens.delete_many([user["user_id"]])
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to remove verification", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
 
+    _index_user(user | {"verified": False})
+    await _revoke_sessions([user["user_id"]])
     return user
 
 
+async def remove_verifications_of_members(
+    guild_id: int,
+    discord_ids: list[str],
+) -> list[User] | ServiceError:
+    """Remove the verification of every verified user among discord_ids.
+
+    Meant for members who left the guild, so roles are left alone. Only
+    users who verified through that guild are affected. The osu!
+    tokens are revoked with bounded concurrency and the users are unverified
+    in a single write, even if some revocations failed: the tokens expire on
+    their own and the user is gone either way.
+    """
+    try:
+        _users = await users.fetch_many_by_discord_ids(discord_ids)
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to fetch users", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
+
+    verified_users = [
+        user for user in _users if user["verified"] and _guild_id_of(user) == guild_id
+    ]
+    if not verified_users:
+        return []
+
+    semaphore = asyncio.Semaphore(settings.MEMBER_REMOVE_REVOKE_CONCURRENCY)
+
+    async def revoke(user: User) -> None:
+        async with semaphore:
+            try:
+                client = await clients.osu_storage.take_client(user["user_id"])
+                async with clients.osu_api_breaker.guard():
+                    await client.revoke_token_remote()
+            except Exception as exc:
+                metrics.increment("member_remove.revoke_failures")
+                logger.warning(
+                    "Failed to revoke osu! token of a member who left",
+                    user_id=user["user_id"],
+                    reason=repr(exc),
+                )
+
+    await asyncio.gather(*(revoke(user) for user in verified_users))
+
+    user_ids = [user["user_id"] for user in verified_users]
+    try:
+        async with clients.database.unit_of_work(name="users.remove_verifications"):
+            await users.remove_verification_many(user_ids)
+            await user_tokens.delete_many(user_ids)
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to remove verifications", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
+
+    for user in verified_users:
+        _index_user(user | {"verified": False})
+    await _revoke_sessions(user_ids)
+
+    return verified_users
+
+
+def _parse_id(value: str | None) -> int | None:
+    """The id as the verified index stores it, if it can."""
+    try:
+        parsed = int(value) if value is not None else None
+    except ValueError:
+        return None
+
+    return parsed if parsed is not None and 0 <= parsed < 2**64 else None
+
+
+def _index_user(user: User) -> None:
+    discord_id = _parse_id(user["discord_id"])
+    if discord_id is None:
+        return
+
+    osu_id = _parse_id(user["osu_id"]) if user["verified"] else None
+    if osu_id is not None:
+        clients.verified_index.set(discord_id, osu_id)
+    else:
+        clients.verified_index.discard(discord_id)
+
+
+async def load_verified_index() -> None:
+    async def members() -> AsyncIterator[tuple[int, int]]:
+        async for discord_id, osu_id in users.iterate_verified_osu_ids():
+            parsed_discord_id, parsed_osu_id = _parse_id(discord_id), _parse_id(osu_id)
+            if parsed_discord_id is not None and parsed_osu_id is not None:
+                yield parsed_discord_id, parsed_osu_id
+
+    with metrics.timed("verified_index.load_time"):
+        await clients.verified_index.load(members())
+
+
+async def refresh_verified_index(keys: list[str] | None) -> None:
+    """Bring the index up to date with users changed by other processes."""
+    if keys is None:
+        await load_verified_index()
+        return
+
+    user_ids = [
+        int(key.removeprefix("user_id:")) for key in keys if key.startswith("user_id:")
+    ]
+    discord_ids = [
+        key.removeprefix("discord_id:") for key in keys if key.startswith("discord_id:")
+    ]
+
+    # the change was announced by the write database, a replica may not
+    # have it yet, and the index would keep the old row until the next one
+    changed_users = []
+    if user_ids:
+        changed_users += await users.fetch_many_by_user_ids(user_ids, primary=True)
+    if discord_ids:
+        changed_users += await users.fetch_many_by_discord_ids(
+            discord_ids,
+            primary=True,
+        )
+
+    for user in changed_users:
+        _index_user(user)
+
+
+async def _revoke_sessions(user_ids: list[int]) -> None:
+    """Reject the stateless sessions issued so far to these users, everywhere."""
+    if settings.SESSION_MODE != "stateless":
+        return
+
+    revoked_at = time.time()
+    clients.session_revocations.revoke_many(
+        (user_id, revoked_at) for user_id in user_ids
+    )
+
+    # the bus only reaches running processes, those started later load this
+    try:
+        await users.record_sessions_revoked(
+            user_ids,
+            datetime.fromtimestamp(revoked_at, timezone.utc),
+        )
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to record revoked sessions", exc_info=exc)
+
+    await clients.invalidation_bus.publish(
+        SESSIONS_TOPIC,
+        [f"{user_id}:{revoked_at}" for user_id in user_ids],
+    )
+
+
+async def load_session_revocations() -> None:
+    revoked_since = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.SESSION_TOKEN_MAX_AGE,
+    )
+    clients.session_revocations.revoke_many(
+        [
+            (user_id, revoked_at.timestamp())
+            async for user_id, revoked_at in users.iterate_revoked_sessions(
+                revoked_since,
+            )
+        ],
+    )
+
+
+async def refresh_session_revocations(keys: list[str] | None) -> None:
+    """Record the sessions other processes revoked."""
+    if keys is None:
+        await load_session_revocations()
+        return
+
+    clients.session_revocations.revoke_many(
+        (int(user_id), float(revoked_at))
+        for user_id, revoked_at in (key.split(":") for key in keys)
+    )
+
+
+async def fetch_verified_osu_id(discord_id: str) -> int | ServiceError:
+    """osu! id of a verified discord user, straight from memory."""
+    parsed_discord_id = _parse_id(discord_id)
+    if parsed_discord_id is None:
+        return ServiceError.USER_NOT_FOUND
+
+    osu_id = clients.verified_index.get(parsed_discord_id)
+    if osu_id is None:
+        return ServiceError.USER_NOT_VERIFIED
+
+    return int(osu_id)
+
+
+async def time_until_username_sync() -> float:
+    completed_at = await bot_state.fetch_value(bot_state.USERNAME_SYNC_COMPLETED_AT)
+    if completed_at is None:
+        return 0
+
+    next_run_at = datetime.fromisoformat(completed_at) + timedelta(
+        seconds=settings.USERNAME_SYNC_INTERVAL,
+    )
+    return max(0, (next_run_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def sync_osu_usernames() -> int | ServiceError:
+    """Refresh the osu! usernames of verified users, returns how many changed.
+
+    Verified users are walked by user_id, USERNAME_SYNC_BATCH_SIZE osu! ids
+    per multi-user lookup and USERNAME_SYNC_CONCURRENCY lookups at a time,
+    through the app client's rate limiter. Renamed users of each page are
+    written in one statement, then the page's last user_id is checkpointed:
+    an interrupted pass picks up where it stopped. Only one process runs a
+    pass at a time.
+    """
+    async with clients.database.advisory_lock(USERNAME_SYNC_LOCK_ID) as locked:
+        if not locked:
+            logger.info("osu! usernames are already being synced elsewhere")
+            return 0
+
+        try:
+            return await _sync_osu_usernames()
+        except DependencyUnavailableError as exc:
+            logger.warning("Stopped syncing osu! usernames", reason=str(exc))
+            return exc.service_error
+        except Exception as exc:  # pragma: no cover
+            logger.error("Failed to sync osu! usernames", exc_info=exc)
+            return ServiceError.INTERNAL_SERVER_ERROR
+
+
+async def _sync_osu_usernames() -> int:
+    cursor = int(await bot_state.fetch_value(bot_state.USERNAME_SYNC_CURSOR) or 0)
+    client = await clients.osu_storage.app_client
+    batch_size = settings.USERNAME_SYNC_BATCH_SIZE
+    renamed_count = 0
+
+    while accounts := await users.fetch_verified_osu_accounts(
+        after_user_id=cursor,
+        limit=batch_size * settings.USERNAME_SYNC_CONCURRENCY,
+    ):
+        lookups = [
+            _fetch_osu_usernames(client, accounts[i : i + batch_size])
+            for i in range(0, len(accounts), batch_size)
+        ]
+        usernames: dict[str, str] = {}
+        for found in await asyncio.gather(*lookups):
+            usernames |= found
+
+        renamed = [
+            account | {"osu_username": usernames[account["osu_id"]]}
+            for account in accounts
+            if account["osu_id"] in usernames
+            and usernames[account["osu_id"]] != account["osu_username"]
+        ]
+        # the cursor only moves past the batch along with its renames
+        async with clients.database.unit_of_work(name="username_sync.batch"):
+            if renamed:
+                await users.update_osu_usernames(renamed)
+
+            cursor = accounts[-1]["user_id"]
+            await bot_state.upsert(bot_state.USERNAME_SYNC_CURSOR, str(cursor))
+
+        renamed_count += len(renamed)
+        metrics.increment("username_sync.checked", len(accounts))
+        metrics.increment("username_sync.renamed", len(renamed))
+
+    async with clients.database.unit_of_work(name="username_sync.complete"):
+        await bot_state.upsert(bot_state.USERNAME_SYNC_CURSOR, "0")
+        await bot_state.upsert(
+            bot_state.USERNAME_SYNC_COMPLETED_AT,
+            datetime.now(timezone.utc).isoformat(),
+        )
+    logger.info("Synced osu! usernames", renamed=renamed_count)
+    return renamed_count
+
+
+async def sweep_unverified() -> tuple[int, int] | ServiceError:
+    """Clear expired verification codes and purge abandoned users.
+
+    Abandoned users are those who never linked an osu! account and haven't
+    clicked the verify button for UNVERIFIED_USER_RETENTION seconds, and
+    whose sessions weren't revoked within SESSION_TOKEN_MAX_AGE. Rows go
+    RETENTION_SWEEP_BATCH_SIZE at a time, RETENTION_SWEEP_BATCH_DELAY
+    seconds apart, so a large backlog doesn't hold locks or flood the WAL.
+    Returns how many codes were cleared and users purged. Only one process
+    sweeps at a time.
+    """
+    async with clients.database.advisory_lock(RETENTION_SWEEP_LOCK_ID) as locked:
+        if not locked:
+            logger.info("Unverified users are already being swept elsewhere")
+            return 0, 0
+
+        now = datetime.now(timezone.utc)
+        untouched_since = now - timedelta(seconds=settings.UNVERIFIED_USER_RETENTION)
+        # sessions revoked before then have expired, nothing to reject anymore
+        revoked_before = now - timedelta(seconds=settings.SESSION_TOKEN_MAX_AGE)
+        try:
+            expired = await _sweep_in_batches(
+                users.expire_verification_codes,
+                "retention.codes_expired",
+            )
+            purged = await _sweep_in_batches(
+                lambda limit: users.purge_abandoned(
+                    untouched_since,
+                    revoked_before,
+                    limit,
+                ),
+                "retention.users_purged",
+            )
+        except Exception as exc:  # pragma: no cover
+            logger.error("Failed to sweep unverified users", exc_info=exc)
+            return ServiceError.INTERNAL_SERVER_ERROR
+
+    logger.info(
+        "Swept unverified users",
+        expired_codes=expired,
+        purged_users=purged,
+    )
+    return expired, purged
+
+
+async def _sweep_in_batches(
+    sweep: Callable[[int], Awaitable[list[User]]],
+    metric: str,
+) -> int:
+    batch_size = settings.RETENTION_SWEEP_BATCH_SIZE
+    swept_count = 0
+
+    while True:
+        swept = await sweep(batch_size)
+        swept_count += len(swept)
+        metrics.increment(metric, len(swept))
+
+        if len(swept) < batch_size:
+            return swept_count
+
+        await asyncio.sleep(settings.RETENTION_SWEEP_BATCH_DELAY)
+
+
+async def _fetch_osu_usernames(
+    client: osu.Client,
+    accounts: list[OsuAccount],
+) -> dict[str, str]:
+    osu_ids = [
+        int(account["osu_id"]) for account in accounts if account["osu_id"].isdigit()
+    ]
+    if not osu_ids:
+        return {}
+
+    async with clients.osu_api_breaker.guard():
+        osu_users = await client.get_users(osu_ids)
+
+    # users missing from the answer (restricted, deleted) are left as they are
+    return {str(osu_user.id): osu_user.username for osu_user in osu_users}
+
+
+def iterate_verified_links(
+    updated_since: datetime | None = None,
+) -> AsyncIterator[VerifiedLink]:
+    return users.iterate_verified_links(updated_since)
+
+
 async def fetch_many(
     page: int = 1,
     page_size: int = 50,
@@ -133,9 +664,12 @@ async def fetch_many(
     return _users
 
 
-async def fetch_by_user_id(user_id: int) -> User | ServiceError:
+async def fetch_by_user_id(
+    user_id: int,
+    primary: bool = False,
+) -> User | ServiceError:
     try:
-        user = await users.fetch_by_user_id(user_id)
+        user = await users.fetch_by_user_id(user_id, primary=primary)
     except Exception as exc:  # pragma: no cover
         logger.error("Failed to fetch user", exc_info=exc)
         return ServiceError.INTERNAL_SERVER_ERROR
@@ -159,6 +693,30 @@ async def fetch_by_discord_id(discord_id: str) -> User | ServiceError:
     return user
 
 
+async def update_discord_usernames(
+    discord_usernames: dict[str, str],
+) -> None | ServiceError:
+    try:
+        await users.update_discord_usernames(discord_usernames)
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to update discord usernames", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
+
+    return None
+
+
+async def fetch_many_by_discord_ids(
+    discord_ids: list[str],
+) -> list[User] | ServiceError:
+    try:
+        _users = await users.fetch_many_by_discord_ids(discord_ids)
+    except Exception as exc:  # pragma: no cover
+        logger.error("Failed to fetch discord users", exc_info=exc)
+        return ServiceError.INTERNAL_SERVER_ERROR
+
+    return _users
+
+
 async def fetch_by_discord_username(discord_username: int) -> User | ServiceError:
     try:
         user = await users.fetch_by_discord_username(discord_username)
@@ -202,13 +760,12 @@ async def partial_update(
     user_id: int,
     discord_id: str | _UnsetSentinel = UNSET,
     discord_username: str | _UnsetSentinel = UNSET,
+    guild_id: str | None | _UnsetSentinel = UNSET,
     osu_id: str | None | _UnsetSentinel = UNSET,
     osu_username: str | None | _UnsetSentinel = UNSET,
     verified: bool | _UnsetSentinel = UNSET,
     verification_code: str | None | _UnsetSentinel = UNSET,
-    access_token: str | None | _UnsetSentinel = UNSET,
-    refresh_token: str | None | _UnsetSentinel = UNSET,
-    token_expires_on: datetime | None | _UnsetSentinel = UNSET,
+    verification_code_expires_on: datetime | None | _UnsetSentinel = UNSET,
     session_id: UUID | None | _UnsetSentinel = UNSET,
 ) -> User | ServiceError:
     try:
@@ -216,13 +773,12 @@ async def partial_update(
             user_id=user_id,
             discord_id=discord_id,
             discord_username=discord_username,
+            guild_id=guild_id,
             osu_id=osu_id,
             osu_username=osu_username,
             verified=verified,
             verification_code=verification_code,
-            access_token=access_token,
-            refresh_token=refresh_token,
-            token_expires_on=token_expires_on,
+            verification_code_expires_on=verification_code_expires_on,
             session_id=session_id,
         )
     except Exception as exc:  # pragma: no cover
@@ -5,12 +5,22 @@ from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 from typing import Any
 
+from adapters import database
+from api.internal.export import export_router
+from api.internal.metrics import metrics_router
+from api.internal.verified import verified_router
+from api.middleware import RequestDeadlineMiddleware
 from api.osu.auth import auth_router
+from api.osu.lookup import lookup_router
 from common import lifecycle
 from common import logger
 from common import settings
+from fastapi import APIRouter
 from fastapi import FastAPI
+from fastapi import Request
+from fastapi import status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 logger.configure_logging(
     app_env=settings.APP_ENV,
@@ -36,6 +46,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestDeadlineMiddleware, timeout=settings.REQUEST_TIMEOUT)
+
+
+@app.exception_handler(database.QueryTimeoutError)
+async def query_timeout_handler(
+    request: Request,
+    exc: database.QueryTimeoutError,
+) -> JSONResponse:
+    logger.warning("Database query timed out", query=exc.name, timeout=exc.timeout)
+    return JSONResponse(
+        {"detail": "Database unavailable"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+api_router = APIRouter()
+api_router.include_router(auth_router)
+api_router.include_router(lookup_router)
+api_router.include_router(metrics_router)
+api_router.include_router(export_router)
+api_router.include_router(verified_router)
 
 # auth hosts
-app.host(settings.DOMAIN if settings.DOMAIN else settings.APP_HOST, auth_router)
+app.host(settings.DOMAIN if settings.DOMAIN else settings.APP_HOST, api_router)
@@ -2,14 +2,46 @@ CREATE TABLE users (
     user_id SERIAL PRIMARY KEY,
     discord_id TEXT NOT NULL,
     discord_username TEXT NOT NULL,
+    guild_id TEXT NULL,
     osu_id TEXT NULL,
     osu_username TEXT NULL,
     verified BOOLEAN NOT NULL DEFAULT FALSE,
     verification_code TEXT NULL,
-    access_token TEXT NULL,
-    refresh_token TEXT NULL,
-    token_expires_on TIMESTAMPTZ NULL,
+    verification_code_expires_on TIMESTAMPTZ NULL,
     session_id UUID NULL,
+    sessions_revoked_at TIMESTAMPTZ NULL,
+    created_at TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+
+-- rewritten on every osu! token refresh, the free space per page keeps it HOT
+CREATE TABLE user_tokens (
+    user_id INTEGER PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+    access_token TEXT NOT NULL,
+    refresh_token TEXT NULL,
+    expires_on TIMESTAMPTZ NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+) WITH (fillfactor = 70);
+
+CREATE TABLE bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE TABLE guilds (
+    guild_id TEXT PRIMARY KEY,
+    verify_channel_id TEXT NOT NULL,
+    verified_role_id TEXT NOT NULL,
     created_at TIMESTAMPTZ NOT NULL,
     updated_at TIMESTAMPTZ NOT NULL
 );
+
+CREATE INDEX users_discord_id_idx ON users (discord_id);
+
+CREATE INDEX users_verification_code_expires_on_idx ON users (verification_code_expires_on)
+    WHERE verification_code IS NOT NULL AND NOT verified;
+CREATE INDEX users_abandoned_idx ON users (updated_at)
+    WHERE NOT verified AND osu_id IS NULL;
+CREATE INDEX users_sessions_revoked_at_idx ON users (sessions_revoked_at)
+    WHERE sessions_revoked_at IS NOT NULL;
@@ -0,0 +1,134 @@
+-- Moves osu! tokens out of users into user_tokens, while the app keeps running.
+--
+-- 1. Run this file with psql, outside of a transaction (no -1): the backfill
+--    commits batch by batch. Until step 3, triggers mirror token writes made
+--    to either table into the other, so processes still on the old code and
+--    those already on the new one see the same tokens.
+-- 2. Roll out the code reading and writing user_tokens.
+-- 3. Run user_tokens_2_contract.sql.
+--
+-- Running it again is harmless, tokens already in user_tokens are kept.
+
+-- fail rather than queue every query on users behind a long transaction
+SET lock_timeout = '5s';
+
+CREATE TABLE IF NOT EXISTS user_tokens (
+    user_id INTEGER PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+    access_token TEXT NOT NULL,
+    refresh_token TEXT NULL,
+    expires_on TIMESTAMPTZ NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+) WITH (fillfactor = 70);
+
+CREATE OR REPLACE FUNCTION user_tokens_from_users() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- written by users_from_user_tokens, already in user_tokens
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    IF NEW.access_token IS NULL THEN
+        DELETE FROM user_tokens WHERE user_id = NEW.user_id;
+    ELSE
+        INSERT INTO user_tokens (user_id, access_token, refresh_token, expires_on,
+                                 updated_at)
+        VALUES (NEW.user_id, NEW.access_token, NEW.refresh_token,
+                NEW.token_expires_on, NOW())
+        ON CONFLICT (user_id) DO UPDATE
+        SET access_token = EXCLUDED.access_token,
+            refresh_token = EXCLUDED.refresh_token,
+            expires_on = EXCLUDED.expires_on,
+            updated_at = EXCLUDED.updated_at;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION users_from_user_tokens() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- written by user_tokens_from_users, already in users
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        UPDATE users
+        SET access_token = NULL,
+            refresh_token = NULL,
+            token_expires_on = NULL
+        WHERE user_id = OLD.user_id
+          AND access_token IS NOT NULL;
+    ELSE
+        -- the backfill copies what's already there, that's no reason to
+        -- rewrite every row of users
+        UPDATE users
+        SET access_token = NEW.access_token,
+            refresh_token = NEW.refresh_token,
+            token_expires_on = NEW.expires_on
+        WHERE user_id = NEW.user_id
+          AND (access_token, refresh_token, token_expires_on)
+              IS DISTINCT FROM (NEW.access_token, NEW.refresh_token, NEW.expires_on);
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER user_tokens_from_users
+AFTER INSERT OR UPDATE OF access_token, refresh_token, token_expires_on ON users
+FOR EACH ROW EXECUTE FUNCTION user_tokens_from_users();
+
+CREATE OR REPLACE TRIGGER users_from_user_tokens
+AFTER INSERT OR UPDATE OR DELETE ON user_tokens
+FOR EACH ROW EXECUTE FUNCTION users_from_user_tokens();
+
+-- copies batch_size users at a time, committing and sleeping pause_seconds in
+-- between so the backfill doesn't hold locks or flood the WAL
+CREATE OR REPLACE PROCEDURE backfill_user_tokens(
+    batch_size INTEGER DEFAULT 1000,
+    pause_seconds DOUBLE PRECISION DEFAULT 0.1
+)
+LANGUAGE plpgsql AS $$
+DECLARE
+    last_user_id INTEGER := 0;
+    batch_last_user_id INTEGER;
+    batch_copied BIGINT;
+    copied BIGINT := 0;
+BEGIN
+    LOOP
+        WITH batch AS (
+            SELECT user_id, access_token, refresh_token, token_expires_on
+            FROM users
+            WHERE user_id > last_user_id
+            ORDER BY user_id
+            LIMIT batch_size
+        ), inserted AS (
+            -- tokens the trigger already put there are newer than ours
+            INSERT INTO user_tokens (user_id, access_token, refresh_token,
+                                     expires_on, updated_at)
+            SELECT user_id, access_token, refresh_token, token_expires_on, NOW()
+            FROM batch
+            WHERE access_token IS NOT NULL
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING user_id
+        )
+        SELECT (SELECT MAX(user_id) FROM batch), (SELECT COUNT(*) FROM inserted)
+        INTO batch_last_user_id, batch_copied;
+
+        EXIT WHEN batch_last_user_id IS NULL;
+
+        last_user_id := batch_last_user_id;
+        copied := copied + batch_copied;
+        COMMIT;
+
+        RAISE NOTICE 'user_tokens backfill: through user_id %, % copied',
+            last_user_id, copied;
+        PERFORM pg_sleep(pause_seconds);
+    END LOOP;
+END
+$$;
+
+CALL backfill_user_tokens();
@@ -0,0 +1,15 @@
+-- Last step of user_tokens_1_expand.sql, once no process runs code reading
+-- tokens from users anymore. Dropping columns doesn't rewrite the table.
+
+SET lock_timeout = '5s';
+
+DROP TRIGGER IF EXISTS user_tokens_from_users ON users;
+DROP TRIGGER IF EXISTS users_from_user_tokens ON user_tokens;
+DROP FUNCTION IF EXISTS user_tokens_from_users();
+DROP FUNCTION IF EXISTS users_from_user_tokens();
+DROP PROCEDURE IF EXISTS backfill_user_tokens(INTEGER, DOUBLE PRECISION);
+
+ALTER TABLE users
+    DROP COLUMN IF EXISTS access_token,
+    DROP COLUMN IF EXISTS refresh_token,
+    DROP COLUMN IF EXISTS token_expires_on;
@@ -0,0 +1,112 @@
+"""Compare the cost of turning a user row into a response, per request.
+
+"validated" is how rows used to reach the API: validated into the pydantic
+`User` model by the session backend, copied back into a dict for the
+services, and re-validated into the response model. "direct" encodes the
+repository row as is, the way `api.osu.models.dump_json` does now. Nothing
+here touches the database or the network.
+
+Usage (from the repository root):
+
+    python loadtest/bench_rows.py --iterations 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+import orjson
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app"))
+
+from api.osu.models import PublicUser  # noqa: E402
+from api.osu.models import User as UserModel  # noqa: E402
+from api.osu.models import dump_json  # noqa: E402
+
+ROW: dict[str, Any] = {
+    "user_id": 727,
+    "discord_id": "123456789012345678",
+    "discord_username": "kohaku",
+    "guild_id": "876543210987654321",
+    "osu_id": "2",
+    "osu_username": "peppy",
+    "verified": True,
+    "verification_code": "a" * 32,
+    "access_token": "t" * 900,
+    "refresh_token": "r" * 700,
+    "session_id": uuid4(),
+    "created_at": datetime.now(timezone.utc),
+    "updated_at": datetime.now(timezone.utc),
+}
+
+
+def user_validated() -> bytes:
+    user = UserModel.model_validate(ROW)
+    dict(user)  # what the services were handed
+    body = PublicUser.model_validate(user, from_attributes=True).model_dump()
+    return orjson.dumps(body, option=orjson.OPT_UTC_Z)
+
+
+def user_direct() -> bytes:
+    return dump_json(PublicUser, ROW)
+
+
+def auth_validated() -> bytes:
+    user = UserModel.model_validate(ROW)
+    dict(user)  # what the session backend was handed
+    return user.model_dump_json().encode()
+
+
+def auth_direct() -> bytes:
+    return dump_json(UserModel, ROW)
+
+
+def _measure(func: Callable[[], bytes], iterations: int) -> dict[str, float]:
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"us": elapsed / iterations * 1_000_000, "peak_bytes": peak - baseline}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100_000)
+    options = parser.parse_args()
+
+    assert orjson.loads(user_validated()) == orjson.loads(user_direct())
+    assert orjson.loads(auth_validated()) == orjson.loads(auth_direct())
+
+    print(f"{'path':<16}{'us/request':>12}{'peak bytes':>12}")
+    for name, func in (
+        ("/user validated", user_validated),
+        ("/user direct", user_direct),
+        ("/auth validated", auth_validated),
+        ("/auth direct", auth_direct),
+    ):
+        result = _measure(func, options.iterations)
+        print(f"{name:<16}{result['us']:>12.2f}{result['peak_bytes']:>12}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
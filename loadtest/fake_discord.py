@@ -0,0 +1,175 @@
+"""Local stand-in for the slice of the Discord REST API the bot uses.
+
+Only REST is emulated, the bot is logged in without a gateway session.
+Behaviour is tuned through environment variables so the scenario runner can
+spawn it with uvicorn:
+
+- FAKE_DISCORD_LATENCY_MS: fixed delay added to every response
+- FAKE_DISCORD_JITTER_MS: extra uniformly distributed delay on top of the latency
+- FAKE_DISCORD_RATE_LIMIT: requests allowed per bucket and window, 0 disables it
+- FAKE_DISCORD_RATE_LIMIT_WINDOW: length of a rate limit window in seconds
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import Counter
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.environ.get("FAKE_DISCORD_LATENCY_MS", "0"))
+JITTER_MS = float(os.environ.get("FAKE_DISCORD_JITTER_MS", "0"))
+RATE_LIMIT = int(os.environ.get("FAKE_DISCORD_RATE_LIMIT", "0"))
+RATE_LIMIT_WINDOW = float(os.environ.get("FAKE_DISCORD_RATE_LIMIT_WINDOW", "1"))
+
+BOT_USER = {
+    "id": "100000000000000001",
+    "username": "kohaku",
+    "discriminator": "0",
+    "global_name": None,
+    "avatar": None,
+    "bot": True,
+}
+
+app = FastAPI()
+stats: Counter[str] = Counter()
+
+# bucket -> (window reset timestamp, requests seen in the window)
+_windows: dict[str, tuple[float, int]] = {}
+
+
+def _rate_limit_headers(bucket: str, remaining: int, reset_at: float) -> dict[str, str]:
+    return {
+        "X-RateLimit-Limit": str(RATE_LIMIT),
+        "X-RateLimit-Remaining": str(max(remaining, 0)),
+        "X-RateLimit-Reset": f"{reset_at:.3f}",
+        "X-RateLimit-Reset-After": f"{max(reset_at - time.time(), 0):.3f}",
+        "X-RateLimit-Bucket": bucket,
+        # discord.py treats 429s without a Via header as a cloudflare ban
+        "Via": "1.1 google",
+    }
+
+
+async def _simulate(
+    endpoint: str,
+    bucket: str,
+) -> tuple[Response | None, dict[str, str]]:
+    stats[endpoint] += 1
+
+    delay = LATENCY_MS + random.uniform(0, JITTER_MS)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+    if RATE_LIMIT <= 0:
+        return None, {}
+
+    now = time.time()
+    reset_at, seen = _windows.get(bucket, (0.0, 0))
+    if now >= reset_at:
+        reset_at, seen = now + RATE_LIMIT_WINDOW, 0
+
+    seen += 1
+    _windows[bucket] = (reset_at, seen)
+
+    headers = _rate_limit_headers(bucket, RATE_LIMIT - seen, reset_at)
+    if seen <= RATE_LIMIT:
+        return None, headers
+
+    stats[f"{endpoint}:429"] += 1
+    retry_after = math.ceil((reset_at - now) * 1000) / 1000
+    response = JSONResponse(
+        {
+            "message": "You are being rate limited.",
+            "retry_after": retry_after,
+            "global": False,
+        },
+        status_code=429,
+        headers=headers | {"Retry-After": str(math.ceil(retry_after))},
+    )
+    return response, headers
+
+
+def _member(guild_id: int, user_id: int) -> dict[str, Any]:
+    return {
+        "user": {
+            "id": str(user_id),
+            "username": f"member{user_id}",
+            "discriminator": "0",
+            "global_name": None,
+            "avatar": None,
+        },
+        "nick": None,
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+@app.get("/api/v10/users/@me")
+async def me_handler() -> Response:
+    error, headers = await _simulate("me", "users/@me")
+    if error is not None:
+        return error
+
+    return JSONResponse(BOT_USER, headers=headers)
+
+
+@app.get("/api/v10/oauth2/applications/@me")
+async def application_handler() -> Response:
+    error, headers = await _simulate("application", "oauth2/applications/@me")
+    if error is not None:
+        return error
+
+    application = {
+        "id": BOT_USER["id"],
+        "name": BOT_USER["username"],
+        "description": "",
+        "icon": None,
+        "bot_public": False,
+        "bot_require_code_grant": False,
+        "owner": BOT_USER,
+        "verify_key": "",
+        "flags": 0,
+    }
+    return JSONResponse(application, headers=headers)
+
+
+@app.get("/api/v10/guilds/{guild_id}/members/{user_id}")
+async def member_handler(guild_id: int, user_id: int) -> Response:
+    error, headers = await _simulate("member", f"guilds/{guild_id}/members")
+    if error is not None:
+        return error
+
+    return JSONResponse(_member(guild_id, user_id), headers=headers)
+
+
+@app.put("/api/v10/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+async def add_role_handler(guild_id: int, user_id: int, role_id: int) -> Response:
+    error, headers = await _simulate("add_role", f"guilds/{guild_id}/roles")
+    if error is not None:
+        return error
+
+    return Response(status_code=204, headers=headers)
+
+
+@app.delete("/api/v10/guilds/{guild_id}/members/{user_id}/roles/{role_id}")
+async def remove_role_handler(guild_id: int, user_id: int, role_id: int) -> Response:
+    error, headers = await _simulate("remove_role", f"guilds/{guild_id}/roles")
+    if error is not None:
+        return error
+
+    return Response(status_code=204, headers=headers)
+
+
+@app.get("/_stats")
+async def stats_handler() -> Response:
+    return JSONResponse(dict(stats))
@@ -0,0 +1,145 @@
+"""Local stand-in for the osu! OAuth and API v2 endpoints kohaku talks to.
+
+Behaviour is tuned through environment variables so the scenario runner can
+spawn it with uvicorn:
+
+- FAKE_OSU_LATENCY_MS: fixed delay added to every response
+- FAKE_OSU_JITTER_MS: extra uniformly distributed delay on top of the latency
+- FAKE_OSU_ERROR_RATE: fraction (0..1) of requests answered with a 503
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Any
+from uuid import uuid4
+
+import jwt
+from fastapi import FastAPI
+from fastapi import Request
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.environ.get("FAKE_OSU_LATENCY_MS", "0"))
+JITTER_MS = float(os.environ.get("FAKE_OSU_JITTER_MS", "0"))
+ERROR_RATE = float(os.environ.get("FAKE_OSU_ERROR_RATE", "0"))
+TOKEN_TTL = 86400
+
+# the signature is never verified by aiosu, it only decodes the claims
+_JWT_SECRET = "fake-osu-signing-key-never-verified"
+
+app = FastAPI()
+stats: Counter[str] = Counter()
+
+
+def _owner_id(code: str) -> int:
+    # the runner uses numeric codes so every virtual user maps to a stable
+    # osu! account, anything else still gets a deterministic id
+    if code.isdigit():
+        return int(code)
+
+    return zlib.crc32(code.encode()) + 1
+
+
+def _issue_token(owner_id: int | None) -> dict[str, Any]:
+    claims = {
+        "sub": str(owner_id) if owner_id is not None else "",
+        "scopes": ["identify", "public"],
+        "jti": uuid4().hex,
+        "exp": int(time.time()) + TOKEN_TTL,
+    }
+    return {
+        "token_type": "Bearer",
+        "expires_in": TOKEN_TTL,
+        "access_token": jwt.encode(claims, _JWT_SECRET, algorithm="HS256"),
+        # the owner is baked into the refresh token so refreshes keep it
+        "refresh_token": f"{owner_id}.{uuid4().hex}" if owner_id is not None else "",
+    }
+
+
+def _fake_user(user_id: int) -> dict[str, Any]:
+    return {
+        "id": user_id,
+        "username": f"player{user_id}",
+        "avatar_url": "https://a.ppy.sh/",
+        "country_code": "JP",
+    }
+
+
+async def _simulate(endpoint: str) -> Response | None:
+    stats[endpoint] += 1
+
+    delay = LATENCY_MS + random.uniform(0, JITTER_MS)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+    if ERROR_RATE > 0 and random.random() < ERROR_RATE:
+        stats[f"{endpoint}:503"] += 1
+        return JSONResponse({"error": "service_unavailable"}, status_code=503)
+
+    return None
+
+
+def _bearer_owner_id(request: Request) -> int:
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    claims = jwt.decode(token, options={"verify_signature": False})
+    return int(claims["sub"] or 0)
+
+
+@app.post("/oauth/token")
+async def token_handler(request: Request) -> Response:
+    # aiosu sends the code exchange as a form and refreshes as json. Read it
+    # before stalling, the caller may have given up by the time we're done.
+    if request.headers.get("Content-Type", "").startswith("application/json"):
+        body: dict[str, Any] = await request.json()
+    else:
+        body = dict(await request.form())
+
+    if (error := await _simulate("token")) is not None:
+        return error
+
+    match body.get("grant_type"):
+        case "authorization_code":
+            return JSONResponse(_issue_token(_owner_id(str(body["code"]))))
+        case "refresh_token":
+            owner_id = int(str(body["refresh_token"]).split(".", 1)[0])
+            return JSONResponse(_issue_token(owner_id))
+        case "client_credentials":
+            return JSONResponse(_issue_token(None))
+        case _:
+            return JSONResponse({"error": "unsupported_grant_type"}, status_code=400)
+
+
+@app.get("/api/v2/me")
+async def me_handler(request: Request) -> Response:
+    if (error := await _simulate("me")) is not None:
+        return error
+
+    return JSONResponse(_fake_user(_bearer_owner_id(request)))
+
+
+@app.get("/api/v2/users")
+async def users_handler(request: Request) -> Response:
+    if (error := await _simulate("users")) is not None:
+        return error
+
+    ids = [int(user_id) for user_id in request.query_params.getlist("ids[]")]
+    return JSONResponse({"users": [_fake_user(user_id) for user_id in ids]})
+
+
+@app.delete("/api/v2/oauth/tokens/current")
+async def revoke_handler() -> Response:
+    if (error := await _simulate("revoke")) is not None:
+        return error
+
+    return Response(status_code=204)
+
+
+@app.get("/_stats")
+async def stats_handler() -> Response:
+    return JSONResponse(dict(stats))
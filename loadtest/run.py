@@ -0,0 +1,373 @@
+"""Drive the /auth -> /user -> /deauth flow against local osu!/Discord stand-ins.
+
+The runner spawns the fake osu! server, the fake Discord server and the app
+(see `target.py`) as separate uvicorn processes, so none of them compete with
+the load generator for an event loop. It then seeds one unverified user per
+virtual user into the database configured in the environment, runs every
+virtual user through the whole flow with bounded concurrency, and prints the
+throughput, latency percentiles and an error breakdown per step.
+
+Usage (from the repository root, with the usual app environment loaded):
+
+    python loadtest/run.py --scenario discord-429 --users 500 --concurrency 50
+
+The database must be a disposable one, seeded rows are deleted afterwards.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "app"
+LOADTEST_DIR = ROOT / "loadtest"
+
+sys.path.insert(0, str(APP_DIR))
+
+from common import clients  # noqa: E402
+from common import lifecycle  # noqa: E402
+from common import settings  # noqa: E402
+from repositories import users  # noqa: E402
+from services import users as users_service  # noqa: E402
+
+SEED_PREFIX = "loadtest-"
+# well outside the snowflake range of real accounts
+DISCORD_ID_BASE = 900_000_000_000_000_000
+OSU_ID_BASE = 90_000_000
+
+STEPS = ("auth", "user", "deauth")
+
+SCENARIOS: dict[str, dict[str, float]] = {
+    "baseline": {},
+    "slow-osu": {"osu_latency_ms": 800, "osu_jitter_ms": 400},
+    "flaky-osu": {"osu_latency_ms": 150, "osu_error_rate": 0.1},
+    "slow-discord": {"discord_latency_ms": 800, "discord_jitter_ms": 400},
+    "discord-429": {"discord_rate_limit": 10, "discord_rate_limit_window": 1},
+}
+
+
+@dataclass
+class StepStats:
+    requests: int = 0
+    latencies: list[float] = field(default_factory=list)
+    errors: Counter[str] = field(default_factory=Counter)
+
+    def percentile(self, pct: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+
+        return statistics.quantiles(self.latencies, n=100)[pct - 1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _spawn(module: str, port: int, env: dict[str, str]) -> subprocess.Popen[bytes]:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            f"{module}:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=APP_DIR,
+        env=os.environ | {"PYTHONPATH": f"{APP_DIR}{os.pathsep}{LOADTEST_DIR}"} | env,
+    )
+
+
+async def _wait_until_up(
+    url: str,
+    process: subprocess.Popen[bytes],
+    timeout: float = 30,
+) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+async def _seed(count: int, run_id: str) -> list[str]:
+    codes = []
+    for i in range(count):
+        code = f"{SEED_PREFIX}{run_id}-{i}"
+        await users.create(
+            discord_id=str(DISCORD_ID_BASE + i),
+            discord_username=f"{SEED_PREFIX}{i}",
+            osu_id=None,
+            osu_username=None,
+            verified=False,
+            verification_code=code,
+            verification_code_expires_on=users_service.verification_code_expiry(),
+        )
+        codes.append(code)
+
+    return codes
+
+
+async def _cleanup() -> None:
+    await clients.database.execute(
+        "DELETE FROM users WHERE discord_username LIKE :prefix",
+        {"prefix": f"{SEED_PREFIX}%"},
+    )
+
+
+async def _virtual_user(
+    transport: httpx.AsyncHTTPTransport,
+    base_url: str,
+    index: int,
+    kohaku_code: str,
+    results: dict[str, StepStats],
+) -> bool:
+    # one client per virtual user keeps the session cookies apart, they share
+    # the connection pool. Closing a client would close the shared transport.
+    client = httpx.AsyncClient(
+        transport=transport,
+        base_url=base_url,
+        headers={"Host": settings.DOMAIN or settings.APP_HOST},
+        timeout=60,
+    )
+    requests = (
+        (
+            "auth",
+            "POST",
+            "/auth",
+            {"kohaku_code": kohaku_code, "osu_code": str(OSU_ID_BASE + index)},
+        ),
+        ("user", "GET", "/user", None),
+        ("deauth", "POST", "/deauth", None),
+    )
+    for step, method, path, body in requests:
+        results[step].requests += 1
+        started_at = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+        except httpx.HTTPError as exc:
+            results[step].errors[type(exc).__name__] += 1
+            return False
+
+        results[step].latencies.append(time.perf_counter() - started_at)
+        if response.status_code != 200:
+            results[step].errors[str(response.status_code)] += 1
+            # later steps need the session this one should have created
+            return False
+
+    return True
+
+
+def _report(
+    options: argparse.Namespace,
+    results: dict[str, StepStats],
+    completed: int,
+    elapsed: float,
+    upstream: dict[str, Any],
+) -> dict[str, Any]:
+    return {
+        "scenario": options.scenario,
+        "users": options.users,
+        "concurrency": options.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "flows_per_s": round(completed / elapsed, 2) if elapsed else 0.0,
+        "completed_flows": completed,
+        "steps": {
+            step: {
+                "requests": stats.requests,
+                "p50_ms": round(stats.percentile(50) * 1000, 1),
+                "p95_ms": round(stats.percentile(95) * 1000, 1),
+                "p99_ms": round(stats.percentile(99) * 1000, 1),
+                "errors": dict(stats.errors),
+            }
+            for step, stats in results.items()
+        },
+        "upstream": upstream,
+    }
+
+
+def _print_report(report: dict[str, Any]) -> None:
+    print(
+        f"scenario={report['scenario']} users={report['users']} "
+        f"concurrency={report['concurrency']} elapsed={report['elapsed_s']}s "
+        f"completed={report['completed_flows']} throughput={report['flows_per_s']} flows/s",
+    )
+    print(
+        f"{'step':<8}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors",
+    )
+    for step, row in report["steps"].items():
+        print(
+            f"{step:<8}{row['requests']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+            f"{row['p99_ms']:>10}  {row['errors'] or '-'}",
+        )
+    for name, counters in report["upstream"].items():
+        print(f"{name}: {counters}")
+    for kind, values in report["app_metrics"].items():
+        for name, value in sorted(values.items()):
+            print(f"app {kind[:-1]} {name}: {value}")
+
+
+async def _run(options: argparse.Namespace) -> dict[str, Any]:
+    scenario = SCENARIOS[options.scenario]
+
+    def knob(name: str, default: float = 0) -> str:
+        value = getattr(options, name)
+        return str(value if value is not None else scenario.get(name, default))
+
+    internal_key = secrets.token_urlsafe()
+    osu_port, discord_port, app_port = _free_port(), _free_port(), _free_port()
+    osu_url = f"http://127.0.0.1:{osu_port}"
+    discord_url = f"http://127.0.0.1:{discord_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    processes = [
+        _spawn(
+            "fake_osu",
+            osu_port,
+            {
+                "FAKE_OSU_LATENCY_MS": knob("osu_latency_ms"),
+                "FAKE_OSU_JITTER_MS": knob("osu_jitter_ms"),
+                "FAKE_OSU_ERROR_RATE": knob("osu_error_rate"),
+            },
+        ),
+        _spawn(
+            "fake_discord",
+            discord_port,
+            {
+                "FAKE_DISCORD_LATENCY_MS": knob("discord_latency_ms"),
+                "FAKE_DISCORD_JITTER_MS": knob("discord_jitter_ms"),
+                "FAKE_DISCORD_RATE_LIMIT": str(int(float(knob("discord_rate_limit")))),
+                "FAKE_DISCORD_RATE_LIMIT_WINDOW": knob("discord_rate_limit_window", 1),
+            },
+        ),
+    ]
+
+    await lifecycle._start_database()
+    await lifecycle._start_invalidation_bus()
+    try:
+        await _cleanup()
+        codes = await _seed(options.users, str(int(time.time())))
+
+        processes.append(
+            _spawn(
+                "target",
+                app_port,
+                {
+                    "OSU_BASE_URL": osu_url,
+                    "FAKE_DISCORD_URL": discord_url,
+                    "DISCORD_BOT_TOKEN": "fake-token",
+                    "INTERNAL_API_KEY": internal_key,
+                    # every virtual user shares the runner's address
+                    "AUTH_IP_RATE_LIMIT": str(options.users * 2),
+                },
+            ),
+        )
+        for url, process in zip(
+            (f"{osu_url}/_stats", f"{discord_url}/_stats", app_url),
+            processes,
+        ):
+            await _wait_until_up(url, process)
+
+        results = {step: StepStats() for step in STEPS}
+        semaphore = asyncio.Semaphore(options.concurrency)
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=options.concurrency),
+        )
+
+        async def bounded(index: int, code: str) -> bool:
+            async with semaphore:
+                return await _virtual_user(transport, app_url, index, code, results)
+
+        started_at = time.perf_counter()
+        flows = await asyncio.gather(
+            *(bounded(i, code) for i, code in enumerate(codes)),
+        )
+        elapsed = time.perf_counter() - started_at
+        await transport.aclose()
+
+        async with httpx.AsyncClient() as client:
+            upstream = {
+                "osu": (await client.get(f"{osu_url}/_stats")).json(),
+                "discord": (await client.get(f"{discord_url}/_stats")).json(),
+            }
+            app_metrics = (
+                await client.get(
+                    f"{app_url}/internal/metrics",
+                    headers={
+                        "Host": settings.DOMAIN or settings.APP_HOST,
+                        "X-Internal-Key": internal_key,
+                    },
+                )
+            ).json()
+
+        report = _report(options, results, sum(flows), elapsed, upstream)
+        report["app_metrics"] = app_metrics
+        return report
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+        await _cleanup()
+        await lifecycle._shutdown_invalidation_bus()
+        await lifecycle._shutdown_database()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="baseline")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--osu-latency-ms", type=float)
+    parser.add_argument("--osu-jitter-ms", type=float)
+    parser.add_argument("--osu-error-rate", type=float)
+    parser.add_argument("--discord-latency-ms", type=float)
+    parser.add_argument("--discord-jitter-ms", type=float)
+    parser.add_argument("--discord-rate-limit", type=int)
+    parser.add_argument("--discord-rate-limit-window", type=float)
+    parser.add_argument("--json", action="store_true", help="print the raw report")
+    options = parser.parse_args()
+
+    report = asyncio.run(_run(options))
+
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,53 @@
+"""ASGI entrypoint running kohaku against the local Discord stand-in.
+
+It is the regular `web_api:app`, except that discord.py is pointed at
+FAKE_DISCORD_URL and the bot only logs into the REST API. The fake server
+doesn't speak the gateway protocol, and nothing in the /auth -> /user ->
+/deauth flow needs it. osu! is redirected through the regular OSU_BASE_URL
+setting.
+"""
+
+from __future__ import annotations
+
+import os
+
+import discord
+import discord.http
+from common import clients
+from common import lifecycle
+from common import logger
+from common import settings
+
+discord.http.Route.BASE = f"{os.environ['FAKE_DISCORD_URL']}/api/v10"
+
+
+async def _start_discord_bot() -> None:
+    logger.info("Starting discord bot (REST only)...")
+
+    from bot import kohaku_bot as bot
+
+    clients.bot = bot.Bot(intents=discord.Intents.none())
+    await clients.bot.login(settings.DISCORD_BOT_TOKEN)
+
+    logger.info("Started discord bot (REST only)")
+
+
+async def _stop_discord_bot() -> None:
+    logger.info("Stopping discord bot (REST only)...")
+
+    # AutoShardedClient.close() expects a gateway connection, which this bot
+    # never opened. Write what it buffered and close the REST session only.
+    await clients.bot.flush_leaving_members()
+    await clients.bot.flush_username_changes()
+    await clients.bot.http.close()
+    del clients.bot
+
+    logger.info("Stopped discord bot (REST only)")
+
+
+lifecycle._start_discord_bot = _start_discord_bot
+lifecycle._stop_discord_bot = _stop_discord_bot
+
+from web_api import app  # noqa: E402
+
+__all__ = ("app",)